@@ -0,0 +1,82 @@
+# Cost attribution report
+# Joins the QUERY_TAG of the app's warehouse statements (see demo/services/query_tags.py) with the spans in
+# log/trace.jsonl, and reports for each stage the warehouse time, the bytes scanned and the time seen by the app.
+# The stage with the largest warehouse time is the first one to optimize.
+#
+# Run from the top of the repository, e.g.
+#   python benchmarks/cost_report.py --days 7 --output log/cost_report.csv
+# ACCOUNT_USAGE.QUERY_HISTORY lags behind by up to 45 minutes.
+
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "demo"))
+import services.cortex_client
+from services.query_tags import APP_NAME
+from services.tracing import STAGE_PREFIXES, TRACE_PATH
+
+QUERY_HISTORY_SQL = """
+select query_tag, total_elapsed_time, execution_time, queued_overload_time, bytes_scanned, warehouse_name
+from snowflake.account_usage.query_history
+where start_time >= dateadd(day, -?, current_timestamp())
+  and try_parse_json(query_tag):app::string = ?
+"""
+
+# Warehouse statements of the app, one row per statement with the fields of its tag
+def load_query_history(session, days: int) -> pd.DataFrame:
+    df = session.sql(QUERY_HISTORY_SQL, params=[days, APP_NAME]).to_pandas()
+    tags = pd.DataFrame([json.loads(t) for t in df["QUERY_TAG"]], index=df.index)
+    df = pd.concat([df.drop(columns=["QUERY_TAG"]), tags], axis=1)
+    for column in ["stage", "session_id", "plan_id", "trace_id"]:
+        if column not in df.columns:
+            df[column] = None
+    return df
+
+# Stage spans of the app, one row per span
+def load_stage_spans(path: str) -> pd.DataFrame:
+    rows = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                span = json.loads(line)
+                if span["name"].startswith(STAGE_PREFIXES):
+                    rows.append(span)
+    return pd.DataFrame(rows, columns=["trace_id", "session_id", "name", "stage", "duration"])
+
+def build_report(queries: pd.DataFrame, spans: pd.DataFrame) -> pd.DataFrame:
+    warehouse = queries.groupby("stage", dropna=False).agg(
+        statements=("TOTAL_ELAPSED_TIME", "size"),
+        warehouse_seconds=("TOTAL_ELAPSED_TIME", lambda v: v.sum() / 1000),
+        execution_seconds=("EXECUTION_TIME", lambda v: v.sum() / 1000),
+        queued_seconds=("QUEUED_OVERLOAD_TIME", lambda v: v.sum() / 1000),
+        gb_scanned=("BYTES_SCANNED", lambda v: v.sum() / 1024 ** 3),
+        traces=("trace_id", "nunique"),
+    )
+    # Only the traces that also ran statements, so that both sides cover the same plans
+    spans = spans[spans["trace_id"].isin(queries["trace_id"].dropna().unique())]
+    app = spans.groupby("stage").agg(app_seconds=("duration", "sum"), app_p95_seconds=("duration", lambda v: v.quantile(0.95)))
+    report = warehouse.join(app, how="outer").fillna(0)
+    report["warehouse_share"] = report["warehouse_seconds"] / max(report["warehouse_seconds"].sum(), 1e-9)
+    return report.sort_values("warehouse_seconds", ascending=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Warehouse usage per stage of the app")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--secrets", default="Snowflake", help="secret set in .streamlit/secrets.toml")
+    parser.add_argument("--trace", default=TRACE_PATH)
+    parser.add_argument("--output", help="write the report as CSV")
+    args = parser.parse_args()
+
+    session = services.cortex_client.connect_snowflake(args.secrets)
+    report = build_report(load_query_history(session, args.days), load_stage_spans(args.trace))
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.round(3))
+    if args.output:
+        report.to_csv(args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# End-to-end benchmark of the plan generation (get_requested_df + generate_activities of YOURPLAN)
+# Runs a corpus of customer requests and reports p50/p95/p99 latency of each stage.
+#
+#   record: call Snowflake/Cortex/Replicate with the "Snowflake" secrets and save the responses into a fixture file
+#   replay: answer every call from the fixture file, waiting for the recorded latency (or not at all with --zero-latency)
+#   local:  use the local stand-in backend (SAKARCTIC_BACKEND=local settings)
+#
+# The warehouse scoring engines ("warehouse", "set", "assignment") run SQL that cannot be recorded, so they can only
+# be measured in record mode, on the live Snowflake session. Replay and local modes score with the "local" engine,
+# so record the fixtures for replay with --engine local.
+#
+# Run from the top of the repository, e.g.
+#   python benchmarks/plan_benchmark.py record
+#   python benchmarks/plan_benchmark.py record --engine local
+#   python benchmarks/plan_benchmark.py replay --repeat 5 --output log/benchmark.json
+# Compare the JSON output of two runs to catch stage-level regressions before deploy.
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "demo"))
+import streamlit as st
+
+import services.cortex_client
+import services.embedding_cache
+import services.response_cache
+from services.customer_request import parse_customer_request
+from services.fixture_backend import FixtureSession
+from services.inquiry_plan import SCORING_ENGINE, build_spots, extract_plan, get_arctic_request, select_plan_categories
+from services.local_backend import LocalSession
+from services.time_slots import travel_dates
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "customer_requests.jsonl")
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "plan_fixtures.jsonl")
+PAGE_PATH = os.path.join(os.path.dirname(__file__), "..", "demo", "pages", "2_🛫YOURPLAN.py")
+ENGINES = ["warehouse", "set", "assignment", "local"]
+STAGES = ["understand", "category_selection", "scoring", "description", "image", "total"]
+PERCENTILES = [50, 95, 99]
+
+def load_page():
+    spec = importlib.util.spec_from_file_location("yourplan_page", PAGE_PATH)
+    page = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(page)
+    return page
+
+# Same text as the one SAKATALK hands over to YOURPLAN
+def load_corpus(path: str) -> List[str]:
+    requests = []
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            if line.strip():
+                pairs = json.loads(line).items()
+                requests.append("{" + "".join(f'"{k}": "{v}",' for k, v in pairs) + "}")
+    return requests
+
+def timed(timings: Dict[str, List[float]], stage: str, func: Callable, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[stage].append(time.perf_counter() - start)
+    return result
+
+# Run one request through the same steps as get_requested_df and generate_activities
+# The scoring runs on scoring_session with engine, everything else on session
+def run_request(page, session, scoring_session, engine: str, request: str, timings: Dict[str, List[float]], with_image: bool):
+    start = time.perf_counter()
+    customer_request = parse_customer_request(request)
+    dates = travel_dates(customer_request.get("travel_start_date"), customer_request.get("travel_end_date"))
+    understood = timed(timings, "understand", get_arctic_request, session, request)
+    restaurant_categories, spot_categories = timed(timings, "category_selection", select_plan_categories, session, understood, customer_request)
+
+    def scoring():
+        restaurants_list, tour_spots = build_spots(dates, restaurant_categories, spot_categories)
+        return extract_plan(scoring_session, understood, restaurants_list, tour_spots, engine)
+    restaurants_df, tours_df, _ = timed(timings, "scoring", scoring)
+
+    all_df = page.add_dummy_activities(page.unite_df(restaurants_df, tours_df))
+    activities = []
+    for _, row in all_df.iterrows():
+        activities.append({
+            "type": row["type"], "category": row["category"], "url": row["website"], "summary": row["summary"], "datetime": row["visit_time"],
+            "location": {"name": row["name"], "latitude": row["latitude"], "longitude": row["longitude"]},
+        })
+
+    def description():
+        for activity in activities:
+            response = page.generate_description(activity)
+            try:
+                description = json.loads(response)
+                activity["title"] = description["catchphrase"]
+                activity["description"] = description["description"]
+            except:
+                activity["title"] = activity["description"] = ""
+    timed(timings, "description", description)
+
+    if with_image:
+        def image():
+            for activity in activities:
+                if activity["type"] != "stay":
+                    session.generate_image(page.image_model, {"prompt": page.generate_prompt(activity)})
+        timed(timings, "image", image)
+    timings["total"].append(time.perf_counter() - start)
+
+def report(timings: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    result = {}
+    print(f"{'stage':<20}{'n':>5}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES))
+    for stage in STAGES:
+        values = timings.get(stage)
+        if not values:
+            continue
+        result[stage] = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+        result[stage]["n"] = len(values)
+        print(f"{stage:<20}{len(values):>5}" + "".join(f"{result[stage][f'p{p}']:>10.3f}" for p in PERCENTILES))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plan generation stage by stage")
+    parser.add_argument("mode", choices=["record", "replay", "local"])
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--fixtures", default=FIXTURE_PATH)
+    parser.add_argument("--zero-latency", action="store_true", help="replay without waiting for the recorded latency")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--warm", action="store_true", help="keep the process-wide caches (vector index, catalog) between requests")
+    parser.add_argument("--engine", choices=ENGINES, help=f"venue scoring engine (default: {SCORING_ENGINE} in record mode, local otherwise)")
+    parser.add_argument("--image", action="store_true", help="include the Replicate image generation (record and replay modes)")
+    parser.add_argument("--output", help="write the percentiles as JSON")
+    args = parser.parse_args()
+    if args.engine is None:
+        args.engine = SCORING_ENGINE if args.mode == "record" else "local"
+    if args.mode != "record" and args.engine != "local":
+        parser.error(f"the {args.engine} engine runs SQL on Snowflake and can only be measured in record mode")
+    if args.mode == "local" and args.image:
+        parser.error("the local backend has no image generation, --image needs record or replay mode")
+
+    # Measure the calls themselves, not the response caches
+    services.response_cache.CACHE_ENABLED = False
+    services.embedding_cache.CACHE_ENABLED = False
+
+    real_session = None
+    if args.mode == "local":
+        session = LocalSession()
+    else:
+        if args.mode == "record":
+            real_session = services.cortex_client.connect_snowflake("Snowflake")
+            os.environ.setdefault("REPLICATE_API_TOKEN", st.secrets["Replicate"]["apikey"])
+        session = FixtureSession(args.fixtures, args.mode, real_session, replay_latency=not args.zero_latency)
+    page = load_page()
+    page.connect_snowflake = lambda: contextlib.nullcontext(session)
+    scoring_session = session if args.engine == "local" else real_session
+
+    timings = defaultdict(list)
+    requests = load_corpus(args.corpus)
+    for i in range(args.repeat):
+        for j, request in enumerate(requests):
+            if not args.warm:
+                st.cache_resource.clear()
+            run_request(page, session, scoring_session, args.engine, request, timings, args.image)
+            print(f"run {i + 1}/{args.repeat}, request {j + 1}/{len(requests)}: {timings['total'][-1]:.3f}s")
+
+    result = report(timings)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump({"mode": args.mode, "engine": args.engine, "zero_latency": args.zero_latency, "repeat": args.repeat, "stages": result}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,22 @@
 import streamlit as st
 
 # Import submodules
+import services.backend_router
 import services.common
 
 # ページ表示
 st.set_page_config(page_title="SakArctic Travel Agency", page_icon="🌍️", layout="wide", initial_sidebar_state="collapsed")
 
 # シークレットの初期化
+# Autoのときは全てのシークレットに負荷分散する
 with st.sidebar:
-    token_sets = [ "Snowflake", "Reserved1", "Reserved2" ]
+    token_sets = [ services.backend_router.AUTO ] + services.backend_router.SECRET_SETS
     token_set = st.selectbox("Select Secrets", token_sets)
-    st.session_state.snowflake_secrets = st.secrets[token_set]
+    st.session_state.snowflake_secrets_name = token_set
+
+    # バックエンドごとの負荷とレイテンシ
+    st.caption("Backends")
+    st.dataframe(services.backend_router.get_router().stats(), hide_index=True, use_container_width=True)
 
 # 不要なセッションステートの削除
 services.common.clear_session_state()
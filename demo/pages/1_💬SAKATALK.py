@@ -1,17 +1,30 @@
-import ast
 import time
 import pandas as pd
 
 import streamlit as st
-import snowflake.connector
-import snowflake.snowpark as snowpark
 
 # Import submodules
+import services.answer_parsers
+import services.backend_router
+import services.chat_turn
 import services.common
+import services.cortex_client
+import services.prompt_budget
+import services.question_bank
+import services.question_prefetch
+import services.tracing
 
 second_page_name = "2_🛫YOURPLAN.py"
 avatar_image_name = "./resources/imgs/sakatoku.png"
 logo_image_name = "./resources/imgs/logo.svg"
+# Questions whose answers are parsed without the LLM (see services/answer_parsers.py)
+slot_types = {
+    "参加者の年齢": "age",
+    "参加者の人数": "people",
+    "旅行を開始する日付": "date",
+    "旅行を終了する日付": "date",
+    "旅行の予算": "budget",
+}
 
 # Initialize Streamlit
 def init():
@@ -52,42 +65,33 @@ def init():
     ''', unsafe_allow_html=True)
 
 # Functions to connect to Snowflake
-@st.cache_resource(ttl=7200)
 def connect_snowflake():
-    # Snowflake connection information stored in session state in home.py
-    connection = snowflake.connector.connect(
-        user=st.session_state.snowflake_secrets["user"],
-        password=st.session_state.snowflake_secrets["password"],
-        account=st.session_state.snowflake_secrets["account"],
-        role=st.session_state.snowflake_secrets["role"],
-        warehouse=st.session_state.snowflake_secrets["warehouse"])
-    # Create a Snowpark session
-    session = snowpark.Session.builder.configs({"connection": connection}).create()
-    return session 
+    # Snowflake secret set selected in home.py
+    # Returns a context manager: the session is borrowed from the pool (or the router for "Auto") and returned at the end of the with block
+    return services.backend_router.connect(st.session_state.get("snowflake_secrets_name", services.backend_router.AUTO))
 
 # Functions for Arctic Execution
-def get_response(session, messages):
-    sql = f'''
-    SELECT SNOWFLAKE.CORTEX.COMPLETE('snowflake-arctic',
-        {messages},
-        {{
-            'temperature': 0.3,
-            'top_p': 0.9
-        }});
-    '''
-    response = session.sql(sql).to_pandas().iloc[0,0]
-    # Convert response to dictionary type
-    response = ast.literal_eval(response)
-    response = response["choices"][0]["messages"]
-    return response
+# stage: name of the chat step, used for tracing and the query tag of the call
+def get_response(session, messages, stage="chat.response"):
+    with services.tracing.span(stage):
+        client = services.cortex_client.get_cortex_client(session)
+        options = {'temperature': 0.3, 'top_p': 0.9}
+        # Limit the answer to the budget of the chat step
+        if stage in services.prompt_budget.BUDGETS:
+            options = services.prompt_budget.complete_options(stage, options)
+        response = client.complete('snowflake-arctic', messages, options)
+        # Extract the message from the response
+        return client.parse_message(response)
 
 # common_question_prompt
-def question_prompt():
+# title: title of the question, the current one by default
+def question_prompt(title=None):
+    title = title or st.session_state.next_question_title
     # Japanese
     prompt = f'''
 #前提
 あなたはお客様に質問しながら、お客様の旅行プランを検討しています。
-次の質問では「{st.session_state.next_question_title}」が知りたいです。
+次の質問では「{title}」が知りたいです。
 
 #依頼
 次の質問文を考えてください。
@@ -95,7 +99,7 @@ def question_prompt():
 
 #制約
 - 質問文の中には、必ずお客様の回答例を含めて出力すること
-- 必ず{st.session_state.next_question_title}に関する内容を質問してください。
+- 必ず{title}に関する内容を質問してください。
 - 出力例の形式で出力してください。
 - 出力時には出力例と同じ文章は出力しないでください。
 
@@ -108,7 +112,7 @@ Where is your travel destination? (e.g., Japan, New York, London, etc.)
     # English ----------
     #Assumption.
     # You are reviewing a customer's travel plans, asking questions of the customer.
-    # You want to know "{st.session_state.next_question_title}" for the next question.
+    # You want to know "{title}" for the next question.
 
     #Request.
     # Please come up with the following question text.
@@ -116,7 +120,7 @@ Where is your travel destination? (e.g., Japan, New York, London, etc.)
 
     #Constraints
     # - Be sure to include an example of the customer's response in the output of the question text.
-    # - Be sure to ask a question about {st.session_state.next_question_title}.
+    # - Be sure to ask a question about {title}.
     # - Output in the format of the example output.
     # - Do not output the same text as the output example when outputting.
 
@@ -124,11 +128,132 @@ Where is your travel destination? (e.g., Japan, New York, London, etc.)
     # What is your budget for the trip? (e.g. 100,000 yen, 100$, etc.)
     # ------------------
 
+# Question text of the title
+# connect: session source such as connect_snowflake, only used when the question is not in the question bank
+def generate_question(connect, title=None):
+    title = title or st.session_state.next_question_title
+    # A precomputed phrasing when the title is in the question bank
+    question = services.question_bank.pick_question(title)
+    if question is not None:
+        return question
+    messages = [{"role": "user", "content": question_prompt(title)}]
+    with connect() as session:
+        return get_response(session, messages, "chat.next_question")
+
+# Generate the questions after the current one in the background while the user is typing
+def prefetch_questions():
+    # Session state is not available in the background threads
+    secrets_name = st.session_state.get("snowflake_secrets_name", services.backend_router.AUTO)
+    # Skipped when every session is in use (PoolBusyError), and the question is then generated when it is asked
+    def generate(title):
+        return generate_question(lambda: services.backend_router.connect(secrets_name, blocking=False), title)
+    upcoming = [key for key, value in st.session_state.result_request.items()
+                if value == "" and key != st.session_state.next_question_title and not services.question_bank.has_question(key)]
+    services.question_prefetch.get_prefetcher().prefetch(upcoming, generate)
+
+# Questions of the chat and their answers, in the order they are asked
+def initial_result_request():
+    # Japanese
+    result_request = {
+        "旅行の行き先": ["san-francisco"],
+        "サンフランシスコ旅行の目的": "",
+        "参加者の年齢": "",
+        "参加者の人数": "",
+        "旅行を開始する日付": "",
+        "旅行を終了する日付": "",
+        "旅行の予算": "",
+        "サンフランシスコ旅行で食べたいもの": "",
+        "サンフランシスコ旅行でしたいこと": ""
+    }
+    # English
+    # result_request = {
+    #     "Travel Destinations": ["san-francisco"],
+    #     "Purpose of Trip": "",
+    #     "Age of participants": "",
+    #     "Number of participants": "",
+    #     "Date to begin travel": "",
+    #     "Date to end travel": "",
+    #     "Travel Budget": "",
+    #     "What to eat while traveling": "",
+    #     "Things to do in the destination": ""
+    # }
+    return result_request
+
+# Title of the first question whose answer has not been filled in, or "" when all are answered
+# skip: title treated as answered (the question being answered now)
+def find_next_question_title(skip=""):
+    for key, value in st.session_state.result_request.items():
+        if value == "" and key != skip:
+            return key
+    return ""
+
+# Prompt of a chat turn: check the answer, extract the value and write the next question in one call
+# following_title: title of the next question, "" after the last question
+def turn_prompt(answer, following_title):
+    if following_title != "":
+        next_question_request = f'''- next_question: 回答が適正な場合、次に「{following_title}」を知るための質問文。お客様の回答例を含めること。(例: Where is your travel destination? (e.g., Japan, New York, London, etc.))'''
+    else:
+        next_question_request = '''- next_question: 空文字列'''
+    # Japanese
+    prompt = f'''#前提
+あなたはお客様に質問しながら、お客様の旅行プランを検討しています。
+あなたは「{st.session_state.next_question_message}」と質問しました。
+お客様は「{answer}」と回答しました。
+
+#依頼
+以下の項目を持つJSONを出力してください。
+- valid: 質問内容に対して回答が適正な場合はtrue、適正でない場合はfalse。回答が大きく外れていなければ適正と判断してください。
+- value: 回答が適正な場合、お客様の回答から「{st.session_state.next_question_title}」に関連する部分のみを英語で抜き出したもの。日付はMM/DDの形式にしてください。
+{next_question_request}
+
+#制約
+- 出力はJSONのみとしてください。
+- 出力はすべて英語でお願いします。
+
+#出力例
+{{"valid": true, "value": "...", "next_question": "..."}}
+
+出力：'''
+    return prompt
+    # English ----------
+    #Assumption.
+    # You are reviewing a customer's travel plans, asking questions of the customer.
+    # You asked "{st.session_state.next_question_message}".
+    # The customer responded "{answer}".
+
+    #Request
+    # Please output JSON with the following fields.
+    # - valid: true if the answer is appropriate to the question, false if not. Judge it appropriate unless it is far off.
+    # - value: if valid, only the part of the answer relevant to "{st.session_state.next_question_title}", in English. Dates in MM/DD format.
+    # - next_question: if valid, the question to know "{following_title}" next, with an example of the customer's answer.
+
+    #Constraints
+    # - Output JSON only.
+    # - All output should be in English.
+
+    #Example output
+    # {{"valid": true, "value": "...", "next_question": "..."}}
+
+    # Output:
+    # ------------------
+
+# Shorter prompt of a chat turn, used when the full prompt fails
+def turn_prompt_short(answer, following_title):
+    next_question_request = f"next_questionは次に「{following_title}」を知るための回答例付きの質問文" if following_title != "" else "next_questionは空文字列"
+    prompt = f'''#前提
+あなたはお客様に質問しながら旅行プランを検討する。あなたは「{st.session_state.next_question_message[0:45]}」と質問した。お客様は「{answer}」と回答した。
+#依頼
+回答が適正ならvalidはtrue適正でなければfalse。valueは回答から抜き出した英語の値。{next_question_request}。
+#制約
+- 出力は{{"valid": true, "value": "...", "next_question": "..."}}の形式のJSONのみとする。
+出力：'''
+    return prompt
+
 # Main function
-def main():
+# connect: session source. A session is checked out only for the Cortex calls, not for the whole rerun
+def main(connect):
     # Initialize Streamlit
     init()
-    session = connect_snowflake()
 
     # Create variables for conversation history
     if "messages" not in st.session_state:
@@ -136,41 +261,11 @@ def main():
 
     # Create variables for user requests
     if "result_request" not in st.session_state:
-        # Japanese
-        st.session_state.result_request = {
-            "旅行の行き先": ["san-francisco"],
-            "サンフランシスコ旅行の目的": "",
-            "参加者の年齢": "",
-            "参加者の人数": "",
-            "旅行を開始する日付": "",
-            "旅行を終了する日付": "",
-            "旅行の予算": "",
-            "サンフランシスコ旅行で食べたいもの": "",
-            "サンフランシスコ旅行でしたいこと": ""
-        }
-        # English
-        # st.session_state.result_request = {
-        #     "Travel Destinations": ["san-francisco"],
-        #     "Purpose of Trip": "",
-        #     "Age of participants": "",
-        #     "Number of participants": "",
-        #     "Date to begin travel": "",
-        #     "Date to end travel": "",
-        #     "Travel Budget": "",
-        #     "What to eat while traveling": "",
-        #     "Things to do in the destination": ""
-        # }
+        st.session_state.result_request = initial_result_request()
 
         # Consideration of questions for which answers have not been filled in
-        st.session_state.next_question_title = ""
-        for key, value in st.session_state.result_request.items():
-            if value == "":
-                st.session_state.next_question_title = key
-                break
-        # Japanese
-        prompt_create_question = question_prompt()
-        messages = [{"role": "user", "content": prompt_create_question}]
-        st.session_state.next_question_message = get_response(session, messages)
+        st.session_state.next_question_title = find_next_question_title()
+        st.session_state.next_question_message = generate_question(connect)
         st.session_state.messages.append({"role": "assistant", "content": st.session_state.next_question_message})
 
 
@@ -197,110 +292,45 @@ def main():
         # check prompt
         if st.session_state.next_question_title != "":
             prompt_escaped = prompt.replace("'", "").replace(",", " ")
-            # Japanese
-            prompt_check_answer = f'''#前提
-あなたはお客様に質問しながら、お客様の旅行プランを検討しています。
-あなたは「{st.session_state.next_question_message}」と質問しました。
-お客様は「{prompt_escaped}」と回答しました。
-
-#依頼
-質問内容に対して回答が適正か判断し、適正な場合はTrue、適正でない場合はFalseと返答してください。
-回答が大きく外れていなければ、適正と判断してください。
-
-#制約
-- 出力はTrueかFalseのいずれかのみとしてください。
-
-出力：'''
-            prompt_check_answer_except = f'''#前提
-あなたはお客様に質問しながら旅行プランを検討する。あなたは「{st.session_state.next_question_message[0:45]}」と質問した。お客様は「{prompt_escaped}」と回答した。
-#依頼
-質問内容に対して回答が適正か判断し適正な場合はTrue適正でない場合はFalseと返答。
-#制約
-- 出力はTrueかFalseのいずれかのみとする。
-出力：'''
-            # English ----------
-            #Assumption.
-            # You are reviewing a customer's travel plans, asking questions of the customer.
-            # You asked "{st.session_state.next_question_message}".
-            # The customer responded "{prompt_escaped}".
-
-            #Request
-            # Please judge whether the answer is appropriate to the question and reply True if appropriate or False if not.
-
-            #Constraints
-            # - Output should be either True or False only.
-
-            # Output:
-            # ------------------
-            try:
-                messages = [{"role": "user", "content": prompt_check_answer}]
-                check_answer = get_response(session, messages).strip()
-            except:
-                messages = [{"role": "user", "content": prompt_check_answer_except}]
-                print("!!! We encountered error !!!")
-                check_answer = get_response(session, messages).strip()
-                
-            if check_answer == "True":
-                # 回答の抽出
-                # Japanese
-                prompt_extract_request = f'''
-#前提
-あなたはお客様に質問しながら、お客様の旅行プランを検討しています。
-あなたは「{st.session_state.next_question_message}」と質問しました。
-お客様は「{prompt_escaped}」と回答しました。
-
-#依頼
-お客様の回答から、質問に関連する部分のみ抜き出してください。
-出力は英語でお願いします。
-
-#制約
-- 必ずお客様の回答から抽出してください。
-- 必ず出力例の形式で出力してください。
-- 日付はMM/DDの形式にしてください。
-
-#出力例
-{{"{st.session_state.next_question_title}": "ユーザーの回答から抽出した結果を記載してください"}}
-
-出力：
-                '''
-                # English ----------
-                #Assumption.
-                # You are reviewing a customer's travel plans, asking questions of the customer.
-                # You asked "{st.session_state.next_question_message}".
-                # The customer responded "{prompt_escaped}".
-
-                #Request
-                # Please extract only the part of the customer's answer that is relevant to the question.
-                # Output shield be in English.
-
-                #Constraints
-                # - Please be sure to extract from the customer's answers.
-                # - Please be sure to output in the format shown in the example output.
-                # - Date must be in MM/DD format.
-
-                #Example output
-                # {{"{st.session_state.next_question_title}": "Please describe the results extracted from user responses"}}
-
-                # Output:
-                # ------------------
-                messages = [{"role": "user", "content": prompt_extract_request}]
-                request = get_response(session, messages).replace("：", ":").strip()
-                request = ast.literal_eval(request)
-                request = list(request.values())[0]
+            # Keep long answers within the token budget of the prompts
+            prompt_escaped = services.prompt_budget.truncate_text(prompt_escaped, services.prompt_budget.input_budget("chat.turn"))
+            # The title of the question after this one, asked in the same call when the answer is valid
+            following_title = find_next_question_title(skip=st.session_state.next_question_title)
+            # Not asked in the turn when it is in the question bank or has been prefetched, so that the answer of the call is short
+            prefetcher = services.question_prefetch.get_prefetcher()
+            question_ready = services.question_bank.has_question(following_title) or prefetcher.has(following_title)
+            turn_following_title = "" if question_ready else following_title
+            # Dates, counts, ages and budgets are checked and normalized locally when the answer is unambiguous
+            fast_value = services.answer_parsers.parse_answer(slot_types.get(st.session_state.next_question_title), prompt)
+            services.tracing.annotate(fast_path=fast_value is not None)
+            if fast_value is not None:
+                turn = {"valid": True, "value": fast_value, "next_question": None}
+            else:
+                # One call checks the answer, extracts the value and writes the next question
+                with connect() as session:
+                    try:
+                        messages = [{"role": "user", "content": turn_prompt(prompt_escaped, turn_following_title)}]
+                        response = get_response(session, messages, "chat.turn")
+                    except:
+                        messages = [{"role": "user", "content": turn_prompt_short(prompt_escaped, turn_following_title)}]
+                        print("!!! We encountered error !!!")
+                        response = get_response(session, messages, "chat.turn")
+                turn = services.chat_turn.parse_turn(response)
+
+            if turn["valid"]:
+                # The answer itself when the value could not be read
+                request = turn["value"] or prompt_escaped
                 st.session_state.result_request[st.session_state.next_question_title] = [request]
 
                 # Consideration of questions for which answers have not been filled in
-                st.session_state.next_question_title = ""
-                for key, value in st.session_state.result_request.items():
-                    if value == "":
-                        st.session_state.next_question_title = key
-                        break
+                st.session_state.next_question_title = find_next_question_title()
                 # Set question if next question
                 if st.session_state.next_question_title != "":
-                    # Japanese
-                    prompt_create_question = question_prompt()
-                    messages = [{"role": "user", "content": prompt_create_question}]
-                    st.session_state.next_question_message = get_response(session, messages)
+                    if turn["next_question"] and st.session_state.next_question_title == turn_following_title:
+                        st.session_state.next_question_message = turn["next_question"]
+                    else:
+                        # The prefetched question, otherwise one of the question bank or a new one
+                        st.session_state.next_question_message = prefetcher.take(st.session_state.next_question_title) or generate_question(connect)
                     st.session_state.messages.append({"role": "assistant", "content": st.session_state.next_question_message})
                     with st.chat_message("assistant", avatar=avatar_image_name):
                         st.markdown(st.session_state.next_question_message)
@@ -347,5 +377,11 @@ def main():
                 st.markdown(thanks_msg)
                 st.session_state.messages.append({"role": "assistant", "content": thanks_msg})
 
+    # Generate the next questions while the user is typing the answer of this one
+    if st.session_state.next_question_title != "":
+        prefetch_questions()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Trace every rerun of the chat, so that the LLM calls of each turn are grouped
+    with services.tracing.activate(services.tracing.start_trace("chat")), services.tracing.span("streamlit.rerun", page="SAKATALK"):
+        main(connect_snowflake)
\ No newline at end of file
@@ -5,8 +5,6 @@
 import streamlit as st
 
 # Snowflake and Snowpark
-import snowflake.connector
-import snowflake.snowpark as snowpark
 import snowflake.cortex as cortex
 
 # Replicate library
@@ -24,13 +22,23 @@ import time
 import os
 
 # Import submodules
+import services.backend_router
 import services.common
+import services.cortex_client
+import services.prompt_budget
+import services.query_tags
+import services.tracing
 from services.inquiry_plan import get_requested_df
+from services.time_slots import TravelDateError
 
 # Default latitude/longitude
 default_latitude = 37.77493
 default_longitude = -122.41942
 
+# Replicate model for the activity images
+image_model = "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"
+# image_model = "bytedance/sdxl-lightning-4step:727e49a643e999d602a896c774a0658ffefea21465756a6ce24b7ea4165eba6a"
+
 # Initialize Streamlit
 def init():
     st.set_page_config(page_title="SakArctic Travel Agency", page_icon="🌍️", layout="wide", initial_sidebar_state="collapsed")
@@ -45,19 +53,10 @@ def init():
     os.environ["REPLICATE_API_TOKEN"] = st.secrets["Replicate"]["apikey"]
 
 # ローカルPython環境からSnowflakeに接続するための関数
-@st.cache_resource(ttl=7200)
+# セッションプール(Autoのときはルータ)から借りたセッションを返すコンテキストマネージャ。withを抜けると返却される
 def connect_snowflake():
-    # Snowflakeの接続情報はhome.pyでセッションステートに保存されたものを使う
-    connection = snowflake.connector.connect(
-        user=st.session_state.snowflake_secrets["user"],
-        password=st.session_state.snowflake_secrets["password"],
-        account=st.session_state.snowflake_secrets["account"],
-        role=st.session_state.snowflake_secrets["role"],
-        warehouse=st.session_state.snowflake_secrets["warehouse"])
-
-    # Snowparkセッションを作成する
-    session = snowpark.Session.builder.configs({"connection": connection}).create()
-    return session 
+    # Snowflakeの接続情報はhome.pyで選択されたシークレットを使う
+    return services.backend_router.connect(st.session_state.get("snowflake_secrets_name", services.backend_router.AUTO))
 
 # JSONをファイルから読み込む
 def read_json(filename: str) -> dict:
@@ -236,12 +235,9 @@ def generate_image(activity):
 
     # Replicate APIを呼び出して画像を生成する
     try:
-        client = replicate.Client(api_token=os.environ["REPLICATE_API_TOKEN"])
-        output = client.run(
-            "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
-            # "bytedance/sdxl-lightning-4step:727e49a643e999d602a896c774a0658ffefea21465756a6ce24b7ea4165eba6a",
-            input=input
-        )
+        with services.tracing.span("image.generate", model=image_model, prompt_chars=len(prompt)):
+            client = replicate.Client(api_token=os.environ["REPLICATE_API_TOKEN"])
+            output = client.run(image_model, input=input)
         return output[0]
     except replicate.exceptions.ModelError as e:
         print(f"Error: {e}")
@@ -342,22 +338,16 @@ def animation_sliders():
         st.session_state.cursor = (st.session_state.cursor + cursor_hop) % (interval_hour + 1)
         st.session_state.loop_count += 1
 
-# 文字列をエスケープする: SQL用
-def escape_string_for_sql(s):
-    return s.replace("'", "''")
-
 # 文字列をエスケープする: JSON用
 def escape_string_for_json(s):
     return s.replace('"', '\\"')
 
 # Snowflakeからレストランデータを取得する
 def get_restaurant_data_from_snowflake(name, cuisine):
-    # Snowflakeに接続する
-    session = connect_snowflake()
-    # SQLを実行してデータを取得する
-    name = escape_string_for_sql(name)
-    cuisine = escape_string_for_sql(cuisine)
-    df_sql = session.sql("SELECT * FROM TOURISM.PUBLIC.CL_RESTAURANTS_FINALIZED WHERE NAME = '{}' AND CUISINE = '{}' LIMIT 1".format(name, cuisine)).to_pandas()
+    # Snowflakeに接続して、SQLを実行してデータを取得する
+    with connect_snowflake() as session, services.tracing.span("sql.to_pandas", table="tourism.public.cl_restaurants_finalized") as span:
+        df_sql = session.sql("SELECT * FROM TOURISM.PUBLIC.CL_RESTAURANTS_FINALIZED WHERE NAME = ? AND CUISINE = ? LIMIT 1", params=[name, cuisine]).to_pandas(statement_params=services.query_tags.statement_params())
+        span.set(rows=len(df_sql))
     return df_sql
 
 # キャッチフレーズと詳細な説明を生成する
@@ -365,7 +355,8 @@ def generate_description(data):
     type = data["type"]
     name = data["location"]["name"]
     category = data["category"]
-    summary = data["summary"]
+    # WEB_SUMMARYは長いことがあるので、トークン数の上限に収まるように切り詰める
+    summary = services.prompt_budget.truncate_text(data["summary"], services.prompt_budget.input_budget("plan.description"))
     visit_time = data["datetime"]
     if type == "stay":
         catchphrase = "Good night."
@@ -375,26 +366,25 @@ def generate_description(data):
         prompt = f'Generate a catchphrase and detailed description for this restaurant. Restaurant information is follows: {{ "name": "{name}", "category": "{category}", "visit_time": "{visit_time}", "web_summary": "{summary}" }} Your output should be formatted as follows: {{ "catchphrase": "...", "description": "..." }}'
     else:
         prompt = f'Generate a catchphrase and detailed description for this sightseeing activity. Sightseeing activity information is follows: {{ "name": "{name}", "category": "{category}", "visit_time": "{visit_time}", "web_summary": "{summary}" }} Your output should be formatted as follows: {{ "catchphrase": "...", "description": "..." }}'
-    prompt = escape_string_for_sql(prompt)
 
     # Snowflake Coretex APIを呼び出してテキストを生成する
     try:
-        session = connect_snowflake()
-        selected_model = "snowflake-arctic"
-        cmd = f"select snowflake.cortex.complete('{selected_model}', [{{'role': 'user', 'content': '{prompt}'}}], {{'temperature': 0.3}}) as RESPONSE"
-        df_response = session.sql(cmd).collect()
-        json_response = json.loads(df_response[0]["RESPONSE"])
-        return json_response['choices'][0]['messages']
+        with connect_snowflake() as session:
+            selected_model = "snowflake-arctic"
+            client = services.cortex_client.get_cortex_client(session)
+            # 同じスポットの説明は使い回せるので、temperatureが0でなくてもキャッシュする
+            options = services.prompt_budget.complete_options("plan.description", {"temperature": 0.3})
+            response = client.complete(selected_model, [{"role": "user", "content": prompt}], options, cache_nonzero_temperature=True)
+        return client.parse_message(response)
     except Exception as e:
         print(f"Error: {e}")
         return None
 
 # 日時文字列を正規化する
 def detetime_str_normalization(datetime_str: str):
-    # 1/1 09:00 -> 2022-01-01T12:00:00Z
+    # 2024/01/01 09:00 -> 2024-01-01T09:00:00Z (the slot keys of services/time_slots.py)
     # datetimeでパースしてから、UTCに変換する
-    dt = datetime.datetime.strptime(datetime_str, '%m/%d %H:%M')
-    dt = dt.replace(year=2024)
+    dt = datetime.datetime.strptime(datetime_str, '%Y/%m/%d %H:%M')
     # Do not convert to UTC
     # dt = dt.astimezone(datetime.timezone.utc)
     return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -421,45 +411,46 @@ def generate_activities(restaurants_filename: str, tour_filename: str) -> list:
 
     # all_dfにアクティビティの情報が格納されている。1行づつ処理していく
     activities = []
-    for index, row in all_df.iterrows():
-        # データをdictに整理する
-        activity = dict()
-        activity["type"] = row['type']
-        activity["category"] = row['category']
-        activity["url"] = row['website']
-        activity["summary"] = row['summary']
-        activity["datetime"] = row['visit_time']
-        activity["location"] = {
-            "name": row['name'],
-            "latitude": row['latitude'],
-            "longitude": row['longitude']
-        }
-
-        # アクティビティの情報からキャッチフレーズと詳細な説明を生成する
-        response = generate_description(activity)
-        if response is None:
-            continue
-
-        try:
-            # 生成した結果をJSONに変換する
-            description = json.loads(response)
-
-            # アクティビティの情報を追加する            
-            activity["title"] = description["catchphrase"]
-            activity["description"] = description["description"]
-
-            # リストに追加する
-            activities.append(activity)
-        except:
-            continue
-
-        # 進捗を更新する
-        with placeholder1.container():
-            header_str = "Generating plans."
-            for _ in range(index + 1):
-                header_str += "."
-            st.subheader(header_str)
-            st.progress((index + 1) / len(all_df))
+    with services.tracing.span("plan.description", rows=len(all_df)):
+        for index, row in all_df.iterrows():
+            # データをdictに整理する
+            activity = dict()
+            activity["type"] = row['type']
+            activity["category"] = row['category']
+            activity["url"] = row['website']
+            activity["summary"] = row['summary']
+            activity["datetime"] = row['visit_time']
+            activity["location"] = {
+                "name": row['name'],
+                "latitude": row['latitude'],
+                "longitude": row['longitude']
+            }
+
+            # アクティビティの情報からキャッチフレーズと詳細な説明を生成する
+            response = generate_description(activity)
+            if response is None:
+                continue
+
+            try:
+                # 生成した結果をJSONに変換する
+                description = json.loads(response)
+
+                # アクティビティの情報を追加する            
+                activity["title"] = description["catchphrase"]
+                activity["description"] = description["description"]
+
+                # リストに追加する
+                activities.append(activity)
+            except:
+                continue
+
+            # 進捗を更新する
+            with placeholder1.container():
+                header_str = "Generating plans."
+                for _ in range(index + 1):
+                    header_str += "."
+                st.subheader(header_str)
+                st.progress((index + 1) / len(all_df))
 
     # セッション変数にアクティビティの情報を保存する
     st.session_state.activities = activities
@@ -478,21 +469,29 @@ def main():
     # Streamlitの初期化
     init()
 
-    # アクティビティの情報を生成する
-    session = connect_snowflake()
-
-    if "customer_request" not in st.session_state:
-        st.warning("You must first communicate your request to SAKATALK!")
-        st.stop()
-
-    st.subheader("Find your travel plan!")
-    st.session_state.restaurants_df, st.session_state.tours_df = get_requested_df(session, st.session_state.customer_request)
-    
-    st.subheader("Generate your travel plan images!")
-    st.session_state.activities = generate_activities("temp/restaurants_result_df.csv", "temp/tour_result_df.csv")
-
-    # すべてのアクティビティを表示
-    animation_sliders()
+    # プランごとにトレースを取り、サイドバーに表示する
+    trace = services.tracing.start_trace("plan")
+    with services.tracing.activate(trace):
+        with services.tracing.span("streamlit.rerun", page="YOURPLAN"):
+            if "customer_request" not in st.session_state:
+                st.warning("You must first communicate your request to SAKATALK!")
+                st.stop()
+
+            # アクティビティの情報を生成する。セッションはプランの抽出の間だけ借りる
+            st.subheader("Find your travel plan!")
+            try:
+                with connect_snowflake() as session:
+                    st.session_state.restaurants_df, st.session_state.tours_df = get_requested_df(session, st.session_state.customer_request)
+            except TravelDateError as e:
+                st.error(f"{e}. Please tell SAKATALK your travel dates again (e.g., 05/03).")
+                st.stop()
+
+            st.subheader("Generate your travel plan images!")
+            st.session_state.activities = generate_activities("temp/restaurants_result_df.csv", "temp/tour_result_df.csv")
+        services.tracing.show_trace_panel(trace)
+
+        # すべてのアクティビティを表示
+        animation_sliders()
 
 if __name__ == "__main__":
     main()
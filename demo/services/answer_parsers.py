@@ -0,0 +1,147 @@
+# Rule-based parsers of simple chat answers
+# Each parser returns the normalized value, or None when the answer needs the LLM.
+
+import datetime
+import re
+from typing import List, Optional
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "eleven": 11, "twelve": 12, "a couple": 2, "couple": 2, "pair": 2,
+}
+KANJI_NUMBERS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+NUMBER_PATTERN = re.compile(r"\d+(?:,\d{3})*(?:\.\d+)?")
+# Longest first, so that "a couple" is one number
+NUMBER_WORD_PATTERN = re.compile(r"\b(" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r")\b")
+KANJI_PEOPLE_PATTERN = re.compile(r"([一二三四五六七八九十])[人名]")
+ALONE_PATTERN = re.compile(r"\b(alone|solo|just me|only me|myself|by myself)\b|一人旅|ひとり")
+# Words an answer of the slot may have besides the numbers. Any other word ("kids", "friends", "with", "days",
+# "dollars", ...) may change the meaning, so the answer is left to the LLM
+PEOPLE_WORDS = re.compile(r"\b(people|persons?|adults?|travell?ers?|of us|in total|we are|we're|we will be)\b|人|名|です")
+AGE_WORDS = re.compile(r"\b(years? old|years|i'm|i am|we are|we're|ages?|and|both)\b|歳|才|です|と|&")
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+# Dates relative to today need the LLM (and the current date)
+RELATIVE_DATE_PATTERN = re.compile(r"\b(today|tomorrow|yesterday|next|this|weekend|week|later)\b|明日|来週|今週|来月")
+CURRENCIES = [
+    (re.compile(r"\$|(?<![a-z])(usd|dollars?)(?![a-z])|ドル"), "USD"),
+    (re.compile(r"¥|￥|(?<![a-z])(jpy|yen)(?![a-z])|円"), "JPY"),
+    (re.compile(r"€|(?<![a-z])(eur|euros?)(?![a-z])|ユーロ"), "EUR"),
+    (re.compile(r"£|(?<![a-z])(gbp|pounds?)(?![a-z])|ポンド"), "GBP"),
+]
+# Amount with an optional unit, e.g. "1,500", "2k", "10万"
+AMOUNT_PATTERN = re.compile(r"(\d+(?:,\d{3})*(?:\.\d+)?)\s*(k\b|万)?")
+AGE_PATTERN = re.compile(r"(\d+)\s*('?s\b|代)?")
+MAX_PEOPLE = 50
+MAX_AGE = 120
+
+def normalize_text(answer: str) -> str:
+    # Full-width digits and symbols to ASCII
+    text = (answer or "").translate(str.maketrans("０１２３４５６７８９／－，．", "0123456789/-,."))
+    return text.strip().lower()
+
+def find_numbers(text: str) -> List[float]:
+    return [float(n.replace(",", "")) for n in NUMBER_PATTERN.findall(text)]
+
+# Whether nothing but the patterns, spaces and punctuation is left of the text
+def consists_of(text: str, patterns: List[re.Pattern]) -> bool:
+    for pattern in patterns:
+        text = pattern.sub(" ", text)
+    return not re.sub(r"[\s,.!?、。！？]+", "", text)
+
+# Number of people, e.g. "2", "two", "2 adults", "2人", "二人", "alone"
+def parse_people(answer: str) -> Optional[str]:
+    text = normalize_text(answer)
+    # "2 adults and 2 kids", "me and a couple of friends" and "2 days" are left to the LLM
+    if not consists_of(text, [NUMBER_PATTERN, NUMBER_WORD_PATTERN, KANJI_PEOPLE_PATTERN, ALONE_PATTERN, PEOPLE_WORDS]):
+        return None
+    numbers = find_numbers(text)
+    numbers += [float(NUMBER_WORDS[word]) for word in NUMBER_WORD_PATTERN.findall(text)]
+    numbers += [float(KANJI_NUMBERS[k]) for k in KANJI_PEOPLE_PATTERN.findall(text)]
+    if not numbers and ALONE_PATTERN.search(text):
+        numbers = [1.0]
+    # Every number is a count of its own, so "2 and 2" is as ambiguous as "2 or 3"
+    if len(numbers) != 1 or not numbers[0].is_integer() or not 1 <= numbers[0] <= MAX_PEOPLE:
+        return None
+    count = int(numbers[0])
+    return "1 person" if count == 1 else f"{count} people"
+
+# Ages of the participants, e.g. "30", "30 and 28", "30s", "30代", "35歳"
+def parse_age(answer: str) -> Optional[str]:
+    text = normalize_text(answer)
+    # Dates ("on 5/3"), ranges and decimals, and answers with other words ("100 dollars", "35 with a 5-year-old")
+    if re.search(r"\d\s*[/\-.:~]\s*\d", text) or not consists_of(text, [AGE_PATTERN, AGE_WORDS]):
+        return None
+    ages = []
+    for number, suffix in AGE_PATTERN.findall(text):
+        age = int(number)
+        if not 0 < age <= MAX_AGE:
+            return None
+        ages.append(f"{age}s" if suffix else str(age))
+    if not ages:
+        return None
+    return ", ".join(ages)
+
+def to_mmdd(month: int, day: int) -> Optional[str]:
+    try:
+        # A leap year, so that 02/29 is accepted
+        datetime.date(2024, month, day)
+    except ValueError:
+        return None
+    return f"{month:02d}/{day:02d}"
+
+# Date as MM/DD, e.g. "05/03", "5/3", "2024-05-03", "May 3rd", "3 May", "5月3日"
+def parse_date(answer: str) -> Optional[str]:
+    text = normalize_text(answer)
+    if RELATIVE_DATE_PATTERN.search(text):
+        return None
+    dates = []
+    for year, month, day in re.findall(r"\b(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})\b", text):
+        dates.append(to_mmdd(int(month), int(day)))
+    text = re.sub(r"\b\d{4}[/\-.]\d{1,2}[/\-.]\d{1,2}\b", " ", text)
+    # Month first, as in the MM/DD the chat asks for
+    for month, day in re.findall(r"\b(\d{1,2})/(\d{1,2})(?:/\d{2,4})?\b", text):
+        dates.append(to_mmdd(int(month), int(day)))
+    for month, day in re.findall(r"(\d{1,2})月(\d{1,2})日", text):
+        dates.append(to_mmdd(int(month), int(day)))
+    month_names = "|".join(MONTHS.keys())
+    for name, day in re.findall(rf"\b({month_names})[a-z]*\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b", text):
+        dates.append(to_mmdd(MONTHS[name], int(day)))
+    for day, name in re.findall(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({month_names})[a-z]*\b", text):
+        dates.append(to_mmdd(MONTHS[name], int(day)))
+    # A range or an invalid date needs the LLM
+    if len(dates) != 1 or dates[0] is None:
+        return None
+    return dates[0]
+
+# Budget as "<amount> <currency>", e.g. "$1,500", "1500 dollars", "100,000 yen", "10万円", "2k USD"
+def parse_budget(answer: str) -> Optional[str]:
+    text = normalize_text(answer)
+    # "1 million yen", "$100 per person per day" and "$3000 each" are left to the LLM
+    if not consists_of(text, [AMOUNT_PATTERN] + [pattern for pattern, _ in CURRENCIES]):
+        return None
+    currencies = {code for pattern, code in CURRENCIES if pattern.search(text)}
+    if len(currencies) != 1:
+        return None
+    amounts = []
+    for number, unit in AMOUNT_PATTERN.findall(text):
+        amount = float(number.replace(",", ""))
+        amount *= {"k": 1000, "万": 10000}.get(unit, 1)
+        amounts.append(amount)
+    if len(amounts) != 1 or amounts[0] <= 0:
+        return None
+    amount = int(amounts[0]) if amounts[0].is_integer() else round(amounts[0], 2)
+    return f"{amount} {currencies.pop()}"
+
+PARSERS = {
+    "people": parse_people,
+    "age": parse_age,
+    "date": parse_date,
+    "budget": parse_budget,
+}
+
+def parse_answer(slot_type: str, answer: str) -> Optional[str]:
+    parser = PARSERS.get(slot_type)
+    return parser(answer) if parser is not None else None
@@ -0,0 +1,100 @@
+# Venue-to-slot assignment
+# Build a slots x venues score matrix from the top-K candidates of each category, and assign a
+# unique venue to every slot in one pass. The remaining candidates are returned as ranked alternates.
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# scipy is optional. Without it the hungarian solver falls back to greedy
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# Number of alternates returned for each slot
+ALTERNATES_PER_SLOT = 3
+
+# Score of a slot x venue pair that cannot be assigned (category mismatch)
+INFEASIBLE = -1e9
+
+# Rows: slots, columns: unique venue names. A venue listed under several categories is one column
+def build_score_matrix(slots: Dict[str, str], candidates: pd.DataFrame, category_col_name: str) -> Tuple[np.ndarray, np.ndarray]:
+    name_codes, names = pd.factorize(candidates["NAME"])
+    category_codes, categories = pd.factorize(candidates[category_col_name])
+    category_name_score = np.full((len(categories) + 1, len(names)), INFEASIBLE)
+    np.maximum.at(category_name_score, (category_codes, name_codes), candidates["SCORE"].to_numpy(dtype=np.float64))
+
+    # Slots whose category has no candidate point to the last row, which is all infeasible
+    category_index = {category: i for i, category in enumerate(categories)}
+    slot_category_codes = np.array([category_index.get(v, len(categories)) for v in slots.values()], dtype=np.int64)
+    return category_name_score[slot_category_codes], np.asarray(names)
+
+# Repeatedly take the best remaining pair in the whole matrix
+def solve_greedy(matrix: np.ndarray) -> np.ndarray:
+    matrix = matrix.copy()
+    assignment = np.full(matrix.shape[0], -1)
+    for _ in range(min(matrix.shape)):
+        slot, venue = np.unravel_index(np.argmax(matrix), matrix.shape)
+        if matrix[slot, venue] <= INFEASIBLE:
+            break
+        assignment[slot] = venue
+        matrix[slot, :] = INFEASIBLE
+        matrix[:, venue] = INFEASIBLE
+    return assignment
+
+# Maximize the total score of the plan
+def solve_hungarian(matrix: np.ndarray) -> np.ndarray:
+    if linear_sum_assignment is None:
+        print("scipy is not installed. Use greedy assignment instead.")
+        return solve_greedy(matrix)
+    assignment = np.full(matrix.shape[0], -1)
+    slots, venues = linear_sum_assignment(matrix, maximize=True)
+    feasible = matrix[slots, venues] > INFEASIBLE
+    assignment[slots[feasible]] = venues[feasible]
+    return assignment
+
+SOLVERS = {
+    "greedy": solve_greedy,
+    "hungarian": solve_hungarian,
+}
+
+# Returns the plan (one row per assigned slot) and the ranked alternates of every slot
+def assign_slots(slots: Dict[str, str], candidates: pd.DataFrame, category_col_name: str, columns: List[str],
+                 solver: str = "greedy", alternates: int = ALTERNATES_PER_SLOT) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    if not slots or candidates.empty:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=columns + ["RANK"])
+
+    matrix, names = build_score_matrix(slots, candidates, category_col_name)
+    assignment = SOLVERS[solver](matrix)
+
+    # One row per venue and category, to look up the venue information
+    venues = candidates.drop_duplicates(subset=["NAME", category_col_name]).set_index(["NAME", category_col_name])
+    slot_keys = list(slots.keys())
+    slot_categories = list(slots.values())
+
+    plan_rows = []
+    for slot, venue in enumerate(assignment):
+        if venue < 0:
+            continue
+        row = venues.loc[(names[venue], slot_categories[slot])].to_dict()
+        row.update({"NAME": names[venue], category_col_name: slot_categories[slot], "VISIT_TIME": slot_keys[slot]})
+        plan_rows.append(row)
+
+    # Alternates: the best venues of each slot that are not used in the plan
+    alternate_matrix = matrix.copy()
+    alternate_matrix[:, assignment[assignment >= 0]] = INFEASIBLE
+    top = np.argsort(-alternate_matrix, axis=1)[:, :alternates]
+    alternate_rows = []
+    for slot in range(len(slot_keys)):
+        for rank, venue in enumerate(top[slot]):
+            if alternate_matrix[slot, venue] <= INFEASIBLE:
+                break
+            row = venues.loc[(names[venue], slot_categories[slot])].to_dict()
+            row.update({"NAME": names[venue], category_col_name: slot_categories[slot], "VISIT_TIME": slot_keys[slot], "RANK": rank + 1})
+            alternate_rows.append(row)
+
+    plan_df = pd.DataFrame(plan_rows, columns=columns)
+    alternates_df = pd.DataFrame(alternate_rows, columns=columns + ["RANK"])
+    return plan_df.sort_values(by=["VISIT_TIME"], ascending=[True]).reset_index(drop=True), alternates_df
@@ -0,0 +1,229 @@
+# Router across the Snowflake secret sets
+# The secret sets of .streamlit/secrets.toml (the ones listed in home.py) may point to different accounts and
+# warehouses. With "Auto" selected, every plan or chat turn takes its session from the least loaded set, and every
+# Cortex call is routed separately, so the load is not bound to the Cortex rate limits of one warehouse.
+#
+# - The load of a set is its in-flight count divided by its weight ("weight" in the secret set, 1 by default)
+# - A set that fails (connection errors, throttling) is skipped for a cooldown, longer when it is throttled, and the
+#   work fails over to the next set. Statement errors are raised at once, since they fail the same way on every set
+# - The latency of every routed call is kept per set and shown in the sidebar of home.py
+# - A routed call never waits for a session: when its set has none free, it runs on the session of the work
+
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from snowflake.connector.errors import HttpError, InterfaceError, InternalError, OperationalError
+from snowflake.snowpark import Session
+from snowflake.snowpark.exceptions import SnowparkServerException
+
+import services.tracing as tracing
+from services.local_backend import LocalBackendError
+from services.session_pool import PoolBusyError, get_session_pool
+
+AUTO = "Auto"
+SECRET_SETS = ["Snowflake", "Reserved1", "Reserved2"]
+# Seconds a set is skipped after an error, and after being throttled
+ERROR_COOLDOWN = 10
+THROTTLE_COOLDOWN = 60
+THROTTLE_MARKERS = ["429", "throttl", "rate limit", "too many requests", "concurrency limit"]
+# Number of latencies kept per set for the report
+LATENCY_WINDOW = 200
+
+current_router = contextvars.ContextVar("current_router", default=None)
+# (Backend, session) checked out by the current piece of work
+current_session = contextvars.ContextVar("current_session", default=None)
+
+def is_throttled(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+# Errors of the set itself, worth a retry or another set. Other errors (bad SQL, a prompt longer than the context
+# window, ...) are errors of the statement
+def is_backend_error(error: Exception) -> bool:
+    backend_errors = (OperationalError, InterfaceError, InternalError, HttpError, SnowparkServerException, ConnectionError, LocalBackendError)
+    return isinstance(error, backend_errors) or is_throttled(error)
+
+class Backend:
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.cooldown_until = 0.0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def load(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+class BackendRouter:
+    def __init__(self, names: List[str], weights: Dict[str, float] = None):
+        weights = weights or {}
+        self.backends = [Backend(name, float(weights.get(name, 1.0))) for name in names]
+        self.lock = threading.Lock()
+
+    # The least loaded set that is not cooling down. If every set is cooling down, the one that recovers first
+    def acquire(self, exclude: List[str] = ()) -> Backend:
+        with self.lock:
+            candidates = [b for b in self.backends if b.name not in exclude]
+            if not candidates:
+                return None
+            now = time.time()
+            available = [b for b in candidates if b.cooldown_until <= now]
+            if available:
+                backend = min(available, key=lambda b: b.load())
+            else:
+                backend = min(candidates, key=lambda b: b.cooldown_until)
+            backend.in_flight += 1
+            return backend
+
+    def release(self, backend: Backend, latency: float = None, error: Exception = None):
+        with self.lock:
+            backend.in_flight -= 1
+            backend.calls += 1
+            if latency is not None:
+                backend.latencies.append(latency)
+            if error is not None:
+                backend.errors += 1
+                throttled = is_throttled(error)
+                backend.throttled += int(throttled)
+                backend.cooldown_until = time.time() + (THROTTLE_COOLDOWN if throttled else ERROR_COOLDOWN)
+
+    # Give back an acquired set that was not used
+    def cancel(self, backend: Backend):
+        with self.lock:
+            backend.in_flight -= 1
+
+    # Move an acquired call from one set to another, without counting it as a call of the first one
+    def transfer(self, backend: Backend, to: Backend) -> Backend:
+        with self.lock:
+            backend.in_flight -= 1
+            to.in_flight += 1
+        return to
+
+    # Run func(session) on the least loaded set, and on the next sets when it fails.
+    # The work already holds a session (current_session), so the call takes a free session of the set without
+    # waiting: waiting for one while holding another deadlocks when every session is held by such work.
+    # When the set has no free session, the call runs on the session of the work, on its set
+    def run(self, func: Callable[[Session], object]):
+        held = current_session.get()
+        tried = []
+        last_error = None
+        while True:
+            backend = self.acquire(exclude=tried)
+            if backend is None:
+                raise last_error or RuntimeError("No Snowflake secret set is configured")
+            tried.append(backend.name)
+            start = time.time()
+            try:
+                pool = get_session_pool(backend.name)
+                session = pool.checkout(blocking=False) if held is not None else pool.checkout()
+                if session is None:
+                    pool = None
+                    backend = self.transfer(backend, held[0])
+                    session = held[1]
+                try:
+                    tracing.annotate(backend=backend.name)
+                    result = func(session)
+                finally:
+                    if pool is not None:
+                        pool.checkin(session)
+            except Exception as e:
+                # The deadline of the call has passed, so there is no time left for another set.
+                # A statement error is not the fault of the set, and would fail on the next one as well
+                if isinstance(e, TimeoutError) or not is_backend_error(e):
+                    self.release(backend, time.time() - start)
+                    raise
+                self.release(backend, time.time() - start, e)
+                print(f"Backend {backend.name} failed, trying the next one: {e}")
+                last_error = e
+                continue
+            self.release(backend, time.time() - start)
+            return result
+
+    # Check out a session of the least loaded set for a piece of work. Falls over to the next set when the
+    # set cannot be connected. Cortex calls made inside the with block are routed separately.
+    # Without blocking, only a free session is taken, and PoolBusyError is raised when every set is in use
+    @contextlib.contextmanager
+    def session(self, blocking: bool = True):
+        tried = []
+        last_error = None
+        while True:
+            backend = self.acquire(exclude=tried)
+            if backend is None:
+                raise last_error or RuntimeError("No Snowflake secret set is configured")
+            tried.append(backend.name)
+            start = time.time()
+            try:
+                pool = get_session_pool(backend.name)
+                session = pool.checkout(blocking=blocking)
+            except Exception as e:
+                self.release(backend, time.time() - start, e)
+                last_error = e
+                continue
+            if session is None:
+                self.cancel(backend)
+                last_error = PoolBusyError("Every session of the Snowflake secret sets is in use")
+                continue
+            break
+        # Errors inside the block are errors of the work, not of the set, and its duration is not a call latency
+        token = current_router.set(self)
+        session_token = current_session.set((backend, session))
+        try:
+            yield session
+        finally:
+            current_session.reset(session_token)
+            current_router.reset(token)
+            pool.checkin(session)
+            self.release(backend)
+
+    def stats(self) -> pd.DataFrame:
+        with self.lock:
+            rows = []
+            for b in self.backends:
+                latencies = list(b.latencies)
+                rows.append({
+                    "backend": b.name, "weight": b.weight, "in_flight": b.in_flight, "calls": b.calls,
+                    "errors": b.errors, "throttled": b.throttled, "cooling_down": b.cooldown_until > time.time(),
+                    "p50_seconds": float(np.percentile(latencies, 50)) if latencies else None,
+                    "p95_seconds": float(np.percentile(latencies, 95)) if latencies else None,
+                })
+            return pd.DataFrame(rows)
+
+# Secret sets present in .streamlit/secrets.toml
+def configured_secret_sets() -> List[str]:
+    try:
+        names = [name for name in SECRET_SETS if name in st.secrets]
+    except Exception:
+        names = []
+    return names or SECRET_SETS[:1]
+
+@st.cache_resource
+def get_router() -> BackendRouter:
+    names = configured_secret_sets()
+    weights = {}
+    for name in names:
+        try:
+            weights[name] = st.secrets[name].get("weight", 1.0)
+        except Exception:
+            weights[name] = 1.0
+    return BackendRouter(names, weights)
+
+# The router of the current piece of work, if it runs under "Auto"
+def get_active_router() -> BackendRouter:
+    return current_router.get()
+
+# Session source of the pages: the router for "Auto", otherwise the pool of the selected secret set.
+# Speculative work connects without blocking, so that it never takes a session a user is waiting for
+def connect(secrets_name: str = AUTO, blocking: bool = True):
+    if secrets_name == AUTO:
+        return get_router().session(blocking)
+    return get_session_pool(secrets_name).session(blocking=blocking)
@@ -0,0 +1,95 @@
+# Category catalog cache
+# The distinct categories of the finalized tables only change when the preparation pipeline runs.
+# They are loaded once per process, shared across sessions, and reloaded in the background
+# when the table version (last altered time and row count) changes.
+
+import threading
+import time
+from typing import Callable, List
+
+import streamlit as st
+from snowflake.snowpark import Session
+
+import services.tracing as tracing
+from services.local_backend import is_local_session
+from services.query_tags import statement_params
+from services.session_pool import session_source
+
+# Seconds between two table version checks
+VERSION_CHECK_INTERVAL = 300
+
+# Fingerprint of a table: last altered time and row count from INFORMATION_SCHEMA
+def get_table_version(session: Session, table_name: str) -> str:
+    if is_local_session(session):
+        return session.table_version(table_name)
+    database, schema, table = table_name.upper().split(".")
+    with tracing.span("sql.table_version", table=table_name):
+        rows = session.sql(f"select last_altered, row_count from {database}.information_schema.tables "
+                           f"where table_schema = '{schema}' and table_name = '{table}'").collect(statement_params=statement_params())
+    if not rows:
+        return ""
+    return f"{rows[0][0]}:{rows[0][1]}"
+
+def get_distinct_list(session: Session, table_name: str, col_name: str) -> List[str]:
+    with tracing.span("sql.distinct_list", table=table_name) as s:
+        if is_local_session(session):
+            categories = session.distinct_list(table_name, col_name)
+        else:
+            categories = session.sql(f"select distinct {col_name} as response from {table_name} "
+                                     f"where {col_name} is not null order by response").to_pandas(statement_params=statement_params())["RESPONSE"].tolist()
+        s.set(rows=len(categories))
+    return categories
+
+class CategoryCatalog:
+    def __init__(self, table_name: str, col_name: str):
+        self.table_name = table_name
+        self.col_name = col_name
+        self.version = None
+        self.categories = []
+        self.checked_at = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    # Return the cached categories. The first call loads them, later calls trigger a background refresh
+    def get(self, session: Session) -> List[str]:
+        with self.lock:
+            if self.version is None:
+                self.refresh(session)
+            elif not self.refreshing and time.time() - self.checked_at > VERSION_CHECK_INTERVAL:
+                self.refreshing = True
+                # The session of the caller goes back to the pool when the caller is done, so the refresh takes its own
+                threading.Thread(target=self.refresh_in_background, args=(session_source(session),), daemon=True).start()
+            return self.categories
+
+    # Reload the categories if the table version changed
+    def refresh(self, session: Session):
+        version = get_table_version(session, self.table_name)
+        if version != self.version or not version:
+            self.categories = get_distinct_list(session, self.table_name, self.col_name)
+            self.version = version
+        self.checked_at = time.time()
+
+    def refresh_in_background(self, connect: Callable):
+        try:
+            with connect() as session:
+                version = get_table_version(session, self.table_name)
+                categories = self.categories
+                if version != self.version or not version:
+                    categories = get_distinct_list(session, self.table_name, self.col_name)
+            with self.lock:
+                self.categories = categories
+                self.version = version
+        except Exception as e:
+            print(f"Error: {e}")
+        finally:
+            with self.lock:
+                self.checked_at = time.time()
+                self.refreshing = False
+
+# One catalog per table and column, shared by all sessions of the process
+@st.cache_resource
+def get_category_catalog(table_name: str, col_name: str) -> CategoryCatalog:
+    return CategoryCatalog(table_name, col_name)
+
+def get_categories(session: Session, table_name: str, col_name: str) -> List[str]:
+    return get_category_catalog(table_name, col_name).get(session)
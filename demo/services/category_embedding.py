@@ -0,0 +1,44 @@
+# Embedding-based category mapping
+# All distinct categories are embedded once per catalog version, and the customer's preferences
+# are mapped to the categories by nearest neighbour instead of a generative LLM call.
+
+from typing import List
+
+import numpy as np
+import streamlit as st
+from snowflake.snowpark import Session
+
+from services.category_catalog import get_category_catalog
+from services.vector_engine import embed_texts
+
+class CategoryEmbeddings:
+    def __init__(self, categories: List[str], vectors: List[List[float]]):
+        self.categories = list(categories)
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(self.categories), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+
+    # Categories ordered by cosine similarity to the preference vector
+    def nearest(self, preference_vector: List[float], top_n: int) -> List[str]:
+        if not self.categories:
+            return []
+        query = np.asarray(preference_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self.matrix @ query
+        top_n = min(top_n, len(self.categories))
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+        return [self.categories[i] for i in top[np.argsort(-scores[top])]]
+
+@st.cache_resource
+def load_category_embeddings(_session: Session, table_name: str, col_name: str, version: str) -> CategoryEmbeddings:
+    categories = get_category_catalog(table_name, col_name).get(_session)
+    return CategoryEmbeddings(categories, embed_texts(_session, categories) if categories else [])
+
+# Embeddings of the current catalog. The cache key follows the catalog version
+def get_category_embeddings(session: Session, table_name: str, col_name: str) -> CategoryEmbeddings:
+    catalog = get_category_catalog(table_name, col_name)
+    catalog.get(session)
+    return load_category_embeddings(session, table_name, col_name, catalog.version)
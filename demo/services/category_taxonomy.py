@@ -0,0 +1,65 @@
+# Compact category encoding for the selection prompts
+# The OSM categories of the finalized tables have many spellings and variants (Japanese, japanese, sushi, ramen, ...).
+# They are canonicalized into groups, the groups are listed in the prompt as short numbered IDs ("1:japanese,2:italian"),
+# and the IDs answered by the model are decoded locally into all the categories of the table in those groups.
+
+import re
+from typing import List
+
+# Variants merged into one canonical category
+MERGED_CATEGORIES = {
+    # Restaurants
+    "sushi": "japanese", "ramen": "japanese", "udon": "japanese", "soba": "japanese", "izakaya": "japanese",
+    "teriyaki": "japanese", "tempura": "japanese", "yakitori": "japanese",
+    "burger": "american", "hamburger": "american", "hot_dog": "american", "diner": "american",
+    "bbq": "barbecue", "barbeque": "barbecue",
+    "taco": "mexican", "tacos": "mexican", "burrito": "mexican", "tex-mex": "mexican",
+    "dim_sum": "chinese", "cantonese": "chinese", "szechuan": "chinese", "sichuan": "chinese", "dumpling": "chinese",
+    "pho": "vietnamese", "banh_mi": "vietnamese",
+    "pasta": "italian", "pizza": "italian",
+    "coffee_shop": "coffee", "cafe": "coffee", "espresso": "coffee",
+    "fish": "seafood", "oyster": "seafood", "fish_and_chips": "seafood",
+    "noodle": "asian", "noodles": "asian",
+    # Sightseeing spots
+    "art_gallery": "gallery", "arts_centre": "gallery",
+    "theme_park": "attraction", "zoo": "attraction", "aquarium": "attraction",
+}
+
+def normalize_category(category: str) -> str:
+    return re.sub(r"[\s\-]+", "_", str(category).strip().lower())
+
+def canonical_category(category: str) -> str:
+    normalized = normalize_category(category)
+    return MERGED_CATEGORIES.get(normalized, normalized)
+
+class CategoryTaxonomy:
+    def __init__(self, categories: List[str]):
+        # Canonical category -> categories of the table, in the order of the input
+        self.groups = {}
+        for category in categories:
+            self.groups.setdefault(canonical_category(category), []).append(category)
+        self.labels = list(self.groups.keys())
+
+    # "1:japanese,2:italian,..." with IDs starting from 1
+    def encode(self) -> str:
+        return ",".join(f"{i + 1}:{label}" for i, label in enumerate(self.labels))
+
+    # Categories of the table in a group, the one spelled as the canonical name first
+    # (then in the catalog order, which lists the categories nearest to the request first)
+    def members(self, label: str) -> List[str]:
+        members = self.groups[label]
+        return sorted(members, key=lambda member: normalize_category(member) != label)
+
+    # Decode the IDs answered by the model into every category of up to limit groups. Unknown IDs and duplicates
+    # are dropped. The groups take turns, so that the time slots filled in this order alternate between them
+    def decode(self, ids: List, limit: int = None) -> List[str]:
+        labels = []
+        for category_id in ids:
+            try:
+                index = int(category_id) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < len(self.labels) and self.labels[index] not in labels:
+                labels.append(self.labels[index])
+        groups = [self.members(label) for label in labels[:limit]]
+        return [group[i] for i in range(max(map(len, groups), default=0)) for group in groups if i < len(group)]
@@ -0,0 +1,59 @@
+# Parse the structured answer of a chat turn
+# One COMPLETE call per user answer returns the validity of the answer, the value extracted from it and the next
+# question, e.g. {"valid": true, "value": "2 people", "next_question": "How old are ...? (e.g., 30s, 20 and 25)"}
+# snowflake-arctic does not always return strict JSON (code fences, single quotes, full-width colons, a bare
+# True/False), so the fields are read with regexes when the text is not JSON.
+
+import ast
+import json
+import re
+from typing import Dict, Optional
+
+OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+VALID_PATTERN = re.compile(r'["\']?valid["\']?\s*:\s*["\']?(true|false)', re.IGNORECASE)
+STRING_FIELD_PATTERN = r'["\']{field}["\']\s*:\s*["\'](.*?)["\']\s*(?=,\s*["\']\w+["\']\s*:|\}}|$)'
+BARE_VALIDITY_PATTERN = re.compile(r"^\W*(true|false)\b", re.IGNORECASE)
+
+def to_bool(value) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+def load_object(text: str) -> Optional[Dict]:
+    match = OBJECT_PATTERN.search(text)
+    if not match:
+        return None
+    for loader in (json.loads, ast.literal_eval):
+        try:
+            data = loader(match.group(0))
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+def string_field(text: str, field: str) -> Optional[str]:
+    match = re.search(STRING_FIELD_PATTERN.format(field=field), text, re.DOTALL)
+    return match.group(1).strip() if match else None
+
+# Returns {"valid": bool or None, "value": str or None, "next_question": str or None}
+# valid is None when the answer says nothing about the validity
+def parse_turn(response: str) -> Dict:
+    text = (response or "").replace("：", ":").strip()
+    data = load_object(text)
+    if data is not None:
+        value = data.get("value")
+        next_question = data.get("next_question")
+        return {
+            "valid": to_bool(data.get("valid")),
+            "value": str(value).strip() if value not in (None, "") else None,
+            "next_question": str(next_question).strip() if next_question else None,
+        }
+    valid = VALID_PATTERN.search(text) or BARE_VALIDITY_PATTERN.search(text)
+    return {
+        "valid": valid.group(1).lower() == "true" if valid else None,
+        "value": string_field(text, "value") or None,
+        "next_question": string_field(text, "next_question") or None,
+    }
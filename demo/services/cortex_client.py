@@ -0,0 +1,150 @@
+# Unified Cortex client
+# Owns the Snowflake session and runs every COMPLETE call with the same throughput controls:
+# a per-process concurrency cap, per-call deadlines, retries with jittered backoff,
+# bind parameters instead of string escaping, and the persistent response cache.
+
+import asyncio
+import contextlib
+import functools
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+import streamlit as st
+from snowflake.snowpark import Session
+
+import services.tracing as tracing
+from services.backend_router import get_active_router, is_backend_error
+from services.local_backend import is_local_session
+from services.prompt_budget import count_tokens
+from services.query_tags import statement_params
+from services.response_cache import cached_complete
+from services.session_pool import borrow, create_session
+
+# Maximum number of COMPLETE calls running at the same time in this process
+MAX_CONCURRENCY = 8
+# Default deadline of one call in seconds
+DEFAULT_TIMEOUT = 90
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 10.0
+POLL_INTERVAL = 0.2
+
+concurrency_limit = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+# A slot of the concurrency cap, waiting for it no longer than the deadline (epoch seconds) of the call
+@contextlib.contextmanager
+def concurrency_slot(deadline: float):
+    if not concurrency_limit.acquire(timeout=max(0.0, deadline - time.time())):
+        raise TimeoutError("Cortex call exceeded its deadline waiting for a concurrency slot")
+    try:
+        yield
+    finally:
+        concurrency_limit.release()
+
+# One shared session for scripts and prototypes. The pages use the session pool (services/session_pool.py)
+@st.cache_resource(ttl=7200)
+def connect_snowflake(secrets_name: str = "Snowflake") -> Session:
+    return create_session(secrets_name)
+
+class CortexClient:
+    def __init__(self, session: Session, timeout: float = DEFAULT_TIMEOUT, max_retries: int = MAX_RETRIES):
+        self.session = session
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    # Build the COMPLETE statement. A string prompt returns the text only,
+    # messages with options return the JSON response with metadata
+    def build_query(self, model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None):
+        if isinstance(messages, str) and not options:
+            return "select snowflake.cortex.complete(?, ?) as RESPONSE", [model, messages]
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        return ("select snowflake.cortex.complete(?, parse_json(?)::array, parse_json(?)::object) as RESPONSE",
+                [model, json.dumps(messages, ensure_ascii=False), json.dumps(options or {})])
+
+    # Run one statement as an async job, and cancel it when the deadline (epoch seconds) passes.
+    # Under the backend router the call is routed across the secret sets. Otherwise it runs on an idle session
+    # of the pool when there is one, so that concurrent calls do not share a connection
+    def run_query(self, query: str, params: list, deadline: float) -> str:
+        with concurrency_slot(deadline):
+            router = get_active_router()
+            if router is not None:
+                return router.run(lambda session: self.run_on(session, query, params, deadline))
+            with borrow(self.session) as session:
+                return self.run_on(session, query, params, deadline)
+
+    def run_on(self, session: Session, query: str, params: list, deadline: float) -> str:
+        if time.time() > deadline:
+            raise TimeoutError("Cortex call exceeded its deadline")
+        job = session.sql(query, params=params).collect_nowait(statement_params=statement_params())
+        while not job.is_done():
+            if time.time() > deadline:
+                job.cancel()
+                raise TimeoutError("Cortex call exceeded its deadline")
+            time.sleep(POLL_INTERVAL)
+        return job.result()[0]["RESPONSE"]
+
+    # The timeout covers the whole call, retries and backoff included
+    def complete_uncached(self, model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None, timeout: float = None) -> str:
+        query, params = self.build_query(model, messages, options)
+        timeout = timeout or self.timeout
+        deadline = time.time() + timeout
+        for attempt in range(self.max_retries + 1):
+            tracing.annotate(retries=attempt)
+            try:
+                if is_local_session(self.session):
+                    with concurrency_slot(deadline):
+                        return self.session.complete(model, messages, options)
+                return self.run_query(query, params, deadline)
+            except TimeoutError:
+                raise
+            except Exception as e:
+                # A statement error fails the same way on a retry
+                if not is_backend_error(e):
+                    raise
+                # Exponential backoff with full jitter, within the deadline
+                wait = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+                if attempt == self.max_retries or time.time() + wait >= deadline:
+                    raise
+                print(f"Retry Cortex call in {wait:.1f} seconds: {e}")
+                time.sleep(wait)
+
+    def complete(self, model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None, timeout: float = None,
+                 cache: bool = True, cache_nonzero_temperature: bool = False, validate: Callable[[str], bool] = None) -> str:
+        with tracing.span("llm.complete", model=model, prompt_chars=tracing.prompt_size(messages), cache_hit=True) as s:
+            def complete_func():
+                s.set(cache_hit=False)
+                return self.complete_uncached(model, messages, options, timeout)
+            if not cache:
+                response = complete_func()
+            else:
+                response = cached_complete(model, messages, options or {}, complete_func,
+                                           cache_nonzero_temperature=cache_nonzero_temperature, validate=validate)
+            s.set(response_chars=len(response or ""), **self.token_usage(messages, response))
+            return response
+
+    async def acomplete(self, model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None, timeout: float = None,
+                        cache: bool = True, cache_nonzero_temperature: bool = False, validate: Callable[[str], bool] = None) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, tracing.bind(functools.partial(self.complete, model, messages, options, timeout, cache, cache_nonzero_temperature, validate)))
+
+    # Input and output tokens of a call: from the usage metadata of the response, or estimated for a text response
+    @staticmethod
+    def token_usage(messages: Union[str, List[Dict[str, str]]], response: str) -> Dict[str, int]:
+        try:
+            usage = json.loads(response)["usage"]
+            return {"prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"]}
+        except (TypeError, ValueError, KeyError):
+            prompt = messages if isinstance(messages, str) else "".join(m.get("content", "") for m in messages)
+            return {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(response)}
+
+    # Text of the first choice of a response with metadata
+    @staticmethod
+    def parse_message(response: str) -> str:
+        return json.loads(response)["choices"][0]["messages"]
+
+def get_cortex_client(session: Session) -> CortexClient:
+    return CortexClient(session)
@@ -0,0 +1,18 @@
+# Parse the customer request built at the end of SAKATALK
+# e.g. {"destination": "san-francisco","purpose": "sightseeing",...,"activity_preferences": "Museum",}
+# The text is not strict JSON (trailing comma, unescaped quotes), so the pairs are read with a regex.
+
+import json
+import re
+from typing import Dict
+
+PAIR_PATTERN = re.compile(r'"([^"]+)"\s*:\s*"(.*?)"\s*(?=,|\})', re.DOTALL)
+
+def parse_customer_request(request: str) -> Dict[str, str]:
+    try:
+        data = json.loads(request)
+        if isinstance(data, dict):
+            return {str(k): str(v) for k, v in data.items()}
+    except (json.JSONDecodeError, TypeError):
+        pass
+    return {key.strip(): value.strip() for key, value in PAIR_PATTERN.findall(request or "")}
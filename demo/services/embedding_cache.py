@@ -0,0 +1,82 @@
+# Request embedding cache
+# Embeddings are memoized by a hash of the normalized text and the model name.
+# The in-memory tier is a bounded LRU with TTL, and an optional SQLite file keeps them across restarts.
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import streamlit as st
+
+# Set to False to always embed (e.g. for benchmarks)
+CACHE_ENABLED = True
+MAX_ENTRIES = 1024
+TTL_SECONDS = 24 * 3600
+# Set a path such as "./log/embedding_cache.sqlite" to enable the on-disk tier
+DISK_CACHE_PATH = None
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+def embedding_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = TTL_SECONDS, disk_path: str = DISK_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if disk_path:
+            self.db = sqlite3.connect(disk_path, check_same_thread=False)
+            self.db.execute("create table if not exists embeddings (key text primary key, vector text, created_at real)")
+            self.db.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        if not CACHE_ENABLED:
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                vector, created_at = entry
+                if now - created_at <= self.ttl:
+                    self.entries.move_to_end(key)
+                    return vector
+                del self.entries[key]
+            if self.db is None:
+                return None
+            row = self.db.execute("select vector, created_at from embeddings where key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            vector = json.loads(row[0])
+            self.store(key, vector, row[1])
+            return vector
+
+    def put(self, key: str, vector: List[float]):
+        if not CACHE_ENABLED:
+            return
+        now = time.time()
+        with self.lock:
+            self.store(key, vector, now)
+            if self.db is not None:
+                self.db.execute("insert or replace into embeddings values (?, ?, ?)", (key, json.dumps(vector), now))
+                self.db.commit()
+
+    # Add to the LRU and evict the least recently used entries. Call with the lock held
+    def store(self, key: str, vector: List[float], created_at: float):
+        self.entries[key] = (vector, created_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+# One cache per process, shared by all sessions
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache()
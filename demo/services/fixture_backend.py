@@ -0,0 +1,100 @@
+# Record/replay backend for benchmarks
+# In "record" mode every Cortex, SQL and Replicate call is executed on the real backend, and its
+# response and latency are appended to a JSONL fixture file. In "replay" mode the responses are
+# returned from the fixture file, waiting for the original latency or not at all.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+import pandas as pd
+from snowflake.snowpark import Session
+
+from services.local_backend import LocalSession
+
+class FixtureMissError(KeyError):
+    pass
+
+def fixture_key(kind: str, args) -> str:
+    payload = json.dumps([kind, args], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class FixtureSession(LocalSession):
+    def __init__(self, fixture_path: str, mode: str = "replay", session: Session = None, replay_latency: bool = True):
+        # The latency comes from the fixtures, and errors from the recorded backend
+        super().__init__(latency={}, error_rate=0.0)
+        self.fixture_path = fixture_path
+        self.mode = mode
+        self.session = session
+        self.replay_latency = replay_latency
+        self.lock = threading.Lock()
+        self.fixtures = {}
+        if os.path.exists(fixture_path):
+            with open(fixture_path, "r", encoding="utf8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.fixtures[entry["key"]] = entry
+        elif mode == "replay":
+            raise FileNotFoundError(f"Fixture file is not found: {fixture_path}")
+
+    # Run func on the real backend and record it, or return the recorded response
+    def call(self, kind: str, args, func: Callable):
+        key = fixture_key(kind, args)
+        if self.mode == "replay":
+            entry = self.fixtures.get(key)
+            if entry is None:
+                raise FixtureMissError(f"No fixture for {kind}: {json.dumps(args, ensure_ascii=False, default=str)[:200]}")
+            if self.replay_latency:
+                time.sleep(entry["latency"])
+            return entry["response"]
+
+        start = time.time()
+        response = func()
+        latency = time.time() - start
+        entry = {"key": key, "kind": kind, "latency": latency, "response": response}
+        with self.lock:
+            self.fixtures[key] = entry
+            os.makedirs(os.path.dirname(self.fixture_path) or ".", exist_ok=True)
+            with open(self.fixture_path, "a", encoding="utf8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        return response
+
+    def complete(self, model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None) -> str:
+        from services.cortex_client import CortexClient
+        return self.call("complete", [model, messages, options],
+                         lambda: CortexClient(self.session, max_retries=0).complete_uncached(model, messages, options))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        from services.vector_engine import query_embeddings
+        return self.call("embed", [texts], lambda: query_embeddings(self.session, texts))
+
+    def table_pandas(self, table_name: str, columns: List[str] = None) -> pd.DataFrame:
+        def load():
+            df = self.session.table(table_name)
+            if columns:
+                df = df.select([c for c in columns if c in df.columns])
+            df = df.to_pandas()
+            if "EMBEDED_WEB_SUMMARY" in df.columns:
+                df["EMBEDED_WEB_SUMMARY"] = df["EMBEDED_WEB_SUMMARY"].apply(lambda v: v if isinstance(v, str) or v is None else json.dumps(list(v)))
+            return df.to_dict(orient="list")
+        return pd.DataFrame(self.call("table", [table_name, columns], load))
+
+    def table_columns(self, table_name: str) -> List[str]:
+        return self.call("columns", [table_name], lambda: list(self.session.table(table_name).columns))
+
+    def table_version(self, table_name: str) -> str:
+        from services.category_catalog import get_table_version
+        return self.call("version", [table_name], lambda: get_table_version(self.session, table_name))
+
+    def distinct_list(self, table_name: str, col_name: str) -> List[str]:
+        from services.category_catalog import get_distinct_list
+        return self.call("distinct", [table_name, col_name], lambda: get_distinct_list(self.session, table_name, col_name))
+
+    # Replicate image generation. Returns the URL of the generated image
+    def generate_image(self, model: str, input: Dict) -> str:
+        import replicate
+        return self.call("replicate", [model, input],
+                         lambda: str(replicate.Client(api_token=os.environ["REPLICATE_API_TOKEN"]).run(model, input=input)[0]))
@@ -1,25 +1,49 @@
+import datetime
 import json
 import re
-from typing import Any, List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Tuple
 
 import pandas as pd
 import streamlit as st
-import snowflake.connector
 import snowflake.snowpark as snowpark
 from snowflake.snowpark import Session
-from snowflake.snowpark.functions import call_udf, col, lit, not_
+from snowflake.snowpark.functions import call_udf, col, lit, not_, row_number, sql_expr
+from snowflake.snowpark.window import Window
+
+import services.backend_router
+import services.cortex_client
+import services.prompt_budget as prompt_budget
+import services.tracing as tracing
+from services.assignment import ALTERNATES_PER_SLOT, assign_slots
+from services.category_catalog import get_categories
+from services.category_embedding import get_category_embeddings
+from services.category_taxonomy import CategoryTaxonomy
+from services.customer_request import parse_customer_request
+from services.local_backend import is_local_session
+from services.plan_validation import validate_categories
+from services.query_tags import statement_params
+from services.time_slots import MEAL_TIMES, TOUR_TIMES, build_time_slots, fill_slots, travel_dates
+from services.vector_engine import embed_request, embed_texts, load_vector_index, result_columns
+
+# Venue scoring engine:
+#   "warehouse" scores on Snowflake and selects one slot per query
+#   "set" scores on Snowflake and resolves every slot in one query
+#   "assignment" fetches the top-K venues per category in one query and assigns them locally
+#   "local" scores in-process with NumPy and assigns locally
+SCORING_ENGINE = "warehouse"
+# Solver of the "assignment" and "local" engines: "greedy" or "hungarian"
+ASSIGNMENT_SOLVER = "greedy"
+
+# Category selection: "llm" asks snowflake-arctic, "embedding" maps the preferences by nearest neighbour
+CATEGORY_SELECTOR = "llm"
+# Number of preferred categories ranked by the selectors
+RANKED_CATEGORIES = 3
+# Categories in the selection prompts: "id" lists canonical categories as numbered IDs, "name" lists the raw names
+CATEGORY_ENCODING = "id"
 
-@st.cache_resource(ttl=7200)
 def connect_snowflake():
-    connection = snowflake.connector.connect(
-        user=st.secrets["Snowflake"]["user"],
-        password=st.secrets["Snowflake"]["password"],
-        account=st.secrets["Snowflake"]["account"],
-        role=st.secrets["Snowflake"]["role"],
-        warehouse=st.secrets["Snowflake"]["warehouse"])
-
-    session = snowpark.Session.builder.configs({"connection": connection}).create()
-    return session 
+    return services.backend_router.connect()
 
 def get_dummy_request() -> str:
     request = '''
@@ -41,6 +65,18 @@ def get_dummy_request() -> str:
     return request
 
 
+# Call an LLM with a single prompt through the Cortex client.
+# With a call site, the answer is limited to the max_tokens of its budget.
+# validate(text) -> bool: answers the caller cannot parse are not cached, so that a retry asks the LLM again
+def complete_prompt(session: Session, prompt: str, model: str = 'snowflake-arctic', call_site: str = None,
+                    validate: Callable[[str], bool] = None) -> str:
+    client = services.cortex_client.get_cortex_client(session)
+    if call_site is None:
+        return client.complete(model, prompt, validate=validate)
+    validate_response = (lambda response: validate(client.parse_message(response))) if validate is not None else None
+    response = client.complete(model, [{"role": "user", "content": prompt}], prompt_budget.complete_options(call_site), validate=validate_response)
+    return client.parse_message(response)
+
 def convert_json_text(input: str) -> str:
     json_pattern = r'\{[\s\S]*?\}'
     match = re.search(json_pattern, input)
@@ -58,116 +94,299 @@ def convert_json_text(input: str) -> str:
         return None
     
 
-def get_restaurants_list(session: Session, request: str):
-    df = session.table("tourism.public.cl_restaurants_finalized")
-    categories = df.select_expr("LISTAGG(DISTINCT cuisine, ' , ')").collect()[0][0]
-    print(categories)
-    output_format = '{"MM/DD hh:mm": "category1", "MM/DD hh:mm": "category2"}'
-    response = df.select(call_udf("snowflake.cortex.complete", 
-                            lit('snowflake-arctic'),
-                            # Based on the customer attribute <customer_requests>, select the category for number of days x morning (8:00 a.m.), lunch (12:00 a.m.), evening (6:00 p.m.) from the list of restaurant categories <categories> and output format. Output JSON according to <output_format>. Please be sure to respond according to <output_format>, not text. \\n
-                            lit('顧客属性<customer_requests>をもとに、レストランカテゴリ<categories>のリストの中から日数分×朝(8時)・昼(12時)・晩(18時)分のカテゴリを選択して、出力形式<output_format>に則ってJSONを出力しなさい。文章ではなく、<output_format>に則った返答をすることに必ず則ってください。\\n'
-                                f'<customer_requests>{request}</customer_requests>\\n<categories>{categories}</categories>\\n<output_format>{output_format}</output_format>')
-                            ).alias('response')).limit(1).to_pandas()["RESPONSE"].iloc[0]
-
-    converted_response = convert_json_text(response)
-    return converted_response
-
-
-def get_tour_spots(session: Session, request: str):
-    df = session.table("tourism.public.tourism_spots_finalized")
-    categories = df.select_expr("LISTAGG(DISTINCT category, ' , ')").collect()[0][0]
-    print(categories)
-    output_format = '{"MM/DD hh:mm": "tour category name", "MM/DD hh:mm": "tour category name", …}'
-    response = df.select(call_udf("snowflake.cortex.complete", 
-                            lit('snowflake-arctic'), 
-                            # Based on the customer attribute <request>, consider what time of day you should visit the tourist destination category <category> (avoid meal times (8:00, 12:00, 18:00)), and create the output format <output_sample> Output it as . At this time, no text should be output. Output only the output format. Also, be sure to select from <category>. \\n'
-                            lit('顧客属性<request>をもとに、観光地カテゴリ<category>をどの時間帯に訪れるべきか考えて（食事の時間帯(8時,12時,18時)を避ける）、出力形式<output_sample>で出力しなさい。'
-                                'このとき、文章を出力してはいけません。出力形式のみを出力しなさい。また、必ず<category>から選択するようにしてください。\\n'
-                                f'<request>{request}</request>\\n<category>{categories}</category>\\n<output_sample>{output_format}</output_sample>')
-                            ).alias('response')).limit(1).to_pandas()["RESPONSE"].iloc[0]
-
-    converted_response = convert_json_text(response)
-    return converted_response
-
-
-def extract_record(session: Session, table_name: str, category_col_name: str, spots: Dict[str, str], request_description: str) -> pd.DataFrame:
+def get_restaurants_list(session: Session, request: str, distinct_restaurants: List[str]):
+    if CATEGORY_ENCODING == "id":
+        return select_category_ids(session, request, "restaurant categories", CategoryTaxonomy(distinct_restaurants))
+    categories = " , ".join(distinct_restaurants)
+    output_format = '{"categories": ["category1", "category2", "category3"]}'
+    # Based on the customer attribute <customer_requests>, select up to {RANKED_CATEGORIES} categories from the list of restaurant categories <categories> in order of preference, and output JSON according to <output_format>. Please be sure to respond according to <output_format>, not text. \n
+    prompt = (f'顧客属性<customer_requests>をもとに、レストランカテゴリ<categories>のリストの中からお客様が好むカテゴリを好ましい順に最大{RANKED_CATEGORIES}個選択して、出力形式<output_format>に則ってJSONを出力しなさい。文章ではなく、<output_format>に則った返答をすることに必ず則ってください。\\n'
+              f'<customer_requests>{request}</customer_requests>\\n<categories>{categories}</categories>\\n<output_format>{output_format}</output_format>')
+    response = complete_prompt(session, prompt, call_site="plan.category_selection",
+                               validate=lambda text: parse_ranked_categories(text) is not None)
+    return parse_ranked_categories(response)
+
+
+def get_tour_spots(session: Session, request: str, distinct_spots: List[str]):
+    if CATEGORY_ENCODING == "id":
+        return select_category_ids(session, request, "tourist destination categories", CategoryTaxonomy(distinct_spots))
+    categories = " , ".join(distinct_spots)
+    output_format = '{"categories": ["tour category name", "tour category name", "tour category name"]}'
+    # Based on the customer attribute <request>, select up to {RANKED_CATEGORIES} tourist destination categories from <category> in order of preference, and output them in the output format <output_sample>. At this time, no text should be output. Output only the output format. Also, be sure to select from <category>. \n'
+    prompt = (f'顧客属性<request>をもとに、観光地カテゴリ<category>の中からお客様が好むカテゴリを好ましい順に最大{RANKED_CATEGORIES}個選択して、出力形式<output_sample>で出力しなさい。'
+              'このとき、文章を出力してはいけません。出力形式のみを出力しなさい。また、必ず<category>から選択するようにしてください。\\n'
+              f'<request>{request}</request>\\n<category>{categories}</category>\\n<output_sample>{output_format}</output_sample>')
+    response = complete_prompt(session, prompt, call_site="plan.category_selection",
+                               validate=lambda text: parse_ranked_categories(text) is not None)
+    return parse_ranked_categories(response)
+
+# Select categories by their IDs in the taxonomy. Returns None if the answer has no valid ID
+def select_category_ids(session: Session, request: str, kind: str, taxonomy: CategoryTaxonomy) -> List[str]:
+    output_format = '{"ids": [3, 1, 2]}'
+    prompt = (f'Based on <customer_requests>, select up to {RANKED_CATEGORIES} {kind} from <categories> in order of preference. '
+              'Each category is listed as id:name. Output only JSON with the ids in the format of <output_format>.\n'
+              f'<customer_requests>{request}</customer_requests>\n<categories>{taxonomy.encode()}</categories>\n<output_format>{output_format}</output_format>')
+    def parse(text):
+        converted_response = convert_json_text(text)
+        if not isinstance(converted_response, dict) or not isinstance(converted_response.get("ids"), list):
+            return None
+        return taxonomy.decode(converted_response["ids"], RANKED_CATEGORIES) or None
+    response = complete_prompt(session, prompt, call_site="plan.category_selection", validate=lambda text: parse(text) is not None)
+    return parse(response)
+
+# {"categories": [...]} -> [...]. Returns None if the answer is not in this format
+def get_ranked_categories(converted_response) -> List[str]:
+    if not isinstance(converted_response, dict):
+        return None
+    categories = converted_response.get("categories")
+    if not isinstance(categories, list):
+        return None
+    return [c for c in categories if isinstance(c, str)][:RANKED_CATEGORIES]
+
+def parse_ranked_categories(text: str) -> List[str]:
+    return get_ranked_categories(convert_json_text(text))
+
+
+# Returns the venues of the slots, and the ranked alternates of every slot (None for the engines without alternates)
+def extract_record(session: Session, table_name: str, category_col_name: str, spots: Dict[str, str], request_description: str,
+                   engine: str = SCORING_ENGINE, request_vector: List[float] = None, solver: str = ASSIGNMENT_SOLVER) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    if engine == "local":
+        if request_vector is None:
+            request_vector = embed_request(session, request_description)
+        index = load_vector_index(session, table_name, category_col_name)
+        with tracing.span("vector.select", table=table_name, slots=len(spots), solver=solver) as s:
+            result_df, alternates_df = index.select(spots, request_vector, solver)
+            s.set(rows=len(result_df))
+        return result_df, alternates_df
+    if engine == "assignment":
+        return extract_record_assignment(session, table_name, category_col_name, spots, request_description, request_vector, solver)
+
+    if engine == "set":
+        return extract_record_set_based(session, table_name, category_col_name, spots, request_description, request_vector), None
+
     result_df = []
     selected_names = set()
     
-    df_base = session.table(table_name)
-    df_base = df_base.with_column("customer_pref_v", call_udf("snowflake.cortex.EMBED_TEXT_768", lit('snowflake-arctic-embed-m'), lit(request_description)))
-    df_base = df_base.with_column("cos_sim", call_udf("VECTOR_COSINE_SIMILARITY", col("customer_pref_v"), col("embeded_web_summary")))
-    if "SUM_CRIME" in df_base.columns:
-        df_base = df_base.with_column("score", col("cos_sim")+(1-(col("sum_crime")-1291)/(68930-1291))*0.05)
-        df_base.write.mode("overwrite").save_as_table("tourism.public.temp_table", table_type="temporary")
-    else:
-        df_base = df_base.with_column("score", col("cos_sim"))
-        df_base.write.mode("overwrite").save_as_table("tourism.public.temp_table", table_type="temporary")
+    # Keep the scores as a lazy expression instead of a shared temp table, so that concurrent plans on
+    # the cached session do not overwrite each other. The request is embedded once and inlined.
+    if request_vector is None:
+        request_vector = embed_request(session, request_description)
+    df_base = score_table(session, table_name, request_description, request_vector)
 
     for spot_k, spot_v in spots.items():
-        df = session.table("tourism.public.temp_table")
-        df = df.where(col(category_col_name)==spot_v)
+        df = df_base.where(col(category_col_name)==spot_v)
         if selected_names:
             df = df.where(not_(col("name").in_(selected_names)))
-        if df.count() == 0:
+        with tracing.span("sql.count", table=table_name) as s:
+            count = df.count(statement_params=statement_params())
+            s.set(rows=count)
+        if count == 0:
             continue
 
         df = df.sort(col("score").desc()).limit(1)
         df = df.with_column("visit_time", lit(spot_k))
-        df.collect()
+        df = df.select(result_columns(category_col_name))
         
-        pd_df = df.to_pandas()
+        with tracing.span("sql.to_pandas", table=table_name) as s:
+            pd_df = df.to_pandas(statement_params=statement_params())
+            s.set(rows=len(pd_df))
         selected_names.add(pd_df["NAME"][0])
         result_df.append(pd_df)
         
-    return pd.concat(result_df, ignore_index=True).sort_values(by=["VISIT_TIME"], ascending=[True])
+    return pd.concat(result_df, ignore_index=True).sort_values(by=["VISIT_TIME"], ascending=[True]), None
 
-def escape_string_for_sql(s):
-    return s.replace("'", "''")
+# Add the similarity between the request and each venue as "score"
+def score_table(session: Session, table_name: str, request_description: str, request_vector: List[float] = None) -> snowpark.DataFrame:
+    df_base = session.table(table_name)
+    if request_vector is None:
+        customer_pref_v = call_udf("snowflake.cortex.EMBED_TEXT_768", lit('snowflake-arctic-embed-m'), lit(request_description))
+    else:
+        customer_pref_v = sql_expr(f"{json.dumps(request_vector)}::VECTOR(FLOAT, {len(request_vector)})")
+    df_base = df_base.with_column("customer_pref_v", customer_pref_v)
+    df_base = df_base.with_column("cos_sim", call_udf("VECTOR_COSINE_SIMILARITY", col("customer_pref_v"), col("embeded_web_summary")))
+    if "SUM_CRIME" in df_base.columns:
+        df_base = df_base.with_column("score", col("cos_sim")+(1-(col("sum_crime")-1291)/(68930-1291))*0.05)
+    else:
+        df_base = df_base.with_column("score", col("cos_sim"))
+    return df_base
+
+# Resolve every slot in one query.
+# The n-th slot of a category gets the n-th best venue of that category, and a venue listed under
+# several categories is kept only under its best one, so that no venue is selected twice.
+def extract_record_set_based(session: Session, table_name: str, category_col_name: str, spots: Dict[str, str], request_description: str,
+                             request_vector: List[float] = None) -> pd.DataFrame:
+    slot_rows = []
+    occurrences = {}
+    for spot_k, spot_v in spots.items():
+        occurrences[spot_v] = occurrences.get(spot_v, 0) + 1
+        slot_rows.append([spot_k, spot_v, occurrences[spot_v]])
+    if not slot_rows:
+        return pd.DataFrame()
+    df_slots = session.create_dataframe(slot_rows, schema=["visit_time", "slot_category", "slot_rank"])
+
+    df = score_table(session, table_name, request_description, request_vector)
+    df = df.where(col(category_col_name).in_(list(occurrences.keys())))
+    df = df.with_column("name_rank", row_number().over(Window.partition_by(col("name")).order_by(col("score").desc(), col(category_col_name))))
+    df = df.where(col("name_rank")==1)
+    df = df.with_column("category_rank", row_number().over(Window.partition_by(col(category_col_name)).order_by(col("score").desc())))
+    df = df.join(df_slots, (col(category_col_name)==col("slot_category")) & (col("category_rank")==col("slot_rank")))
+    df = df.select(result_columns(category_col_name))
+
+    with tracing.span("sql.to_pandas", table=table_name, slots=len(slot_rows)) as s:
+        result_df = df.sort(col("visit_time")).to_pandas(statement_params=statement_params()).reset_index(drop=True)
+        s.set(rows=len(result_df))
+    return result_df
+
+# Fetch the top-K venues of every requested category in one query, and assign them to the slots locally.
+# Returns the plan and the ranked alternates of every slot.
+def extract_record_assignment(session: Session, table_name: str, category_col_name: str, spots: Dict[str, str], request_description: str,
+                              request_vector: List[float] = None, solver: str = ASSIGNMENT_SOLVER) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    columns = result_columns(category_col_name)
+    if not spots:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=columns + ["RANK"])
+    top_k = len(spots) + ALTERNATES_PER_SLOT
+
+    df = score_table(session, table_name, request_description, request_vector)
+    df = df.where(col(category_col_name).in_(list(set(spots.values()))))
+    df = df.with_column("category_rank", row_number().over(Window.partition_by(col(category_col_name)).order_by(col("score").desc())))
+    df = df.where(col("category_rank") <= top_k)
+    df = df.select([c for c in columns if c != "VISIT_TIME"] + ["SCORE"])
+
+    with tracing.span("sql.to_pandas", table=table_name, slots=len(spots)) as s:
+        candidates = df.to_pandas(statement_params=statement_params())
+        s.set(rows=len(candidates))
+    return assign_slots(spots, candidates, category_col_name, columns, solver)
 
 def get_arctic_request(session: Session, request: str) -> str:
-    return session.sql(f"select snowflake.cortex.complete('snowflake-arctic', 'Please describe in sentences the customer attributes especially for activities and food preferences in English based on the following JSON request:{request}') as response").to_pandas()["RESPONSE"].iloc[0]
-
-def get_distinct_list(session: Session, table_name: str, col_name: str) -> List[str]:
-    return session.sql(f"select distinct {col_name} as response from {table_name}").to_pandas()["RESPONSE"].tolist()
-
-def check_common_elements(list1: List[Any], list2: List[Any]) -> bool:
-    return bool(set(list1)&set(list2))
-
-def get_requested_df(session: Session, request: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    request = prompt_budget.truncate_text(request, prompt_budget.input_budget("plan.understand"))
+    prompt = f"Please describe in sentences the customer attributes especially for activities and food preferences in English based on the following JSON request:{request}"
+    return complete_prompt(session, prompt, call_site="plan.understand")
+
+# Ask the LLM again only for the categories that are not in the catalog
+def repair_categories(session: Session, request: str, broken: List[str], distinct_list: List[str]) -> List[str]:
+    categories = " , ".join(distinct_list)
+    broken_categories = json.dumps({"categories": broken}, ensure_ascii=False)
+    prompt = ('The categories in <broken_categories> are not in <categories>. Based on <customer_requests>, replace each of them with one category selected from <categories>. '
+              'Output only JSON in the same format as <broken_categories>.\n'
+              f'<customer_requests>{request}</customer_requests>\n<categories>{categories}</categories>\n<broken_categories>{broken_categories}</broken_categories>')
+    response = complete_prompt(session, prompt, call_site="plan.category_selection",
+                               validate=lambda text: parse_ranked_categories(text) is not None)
+    repaired = parse_ranked_categories(response)
+    return repaired if repaired is not None else []
+
+# Ask the LLM for ranked categories, then validate each one against the catalog.
+# Unknown categories are mapped to the nearest one, and only the remaining broken ones are asked again.
+# The whole selection is retried only when the answer is not JSON at all.
+def select_categories(select_func, session: Session, request: str, distinct_list: List[str], max_retries: int = 5) -> List[str]:
+    for _ in range(max_retries):
+        selected = select_func(session, request, distinct_list)
+        if selected is not None:
+            break
+        print("Run again because we encountered an error in the data.")
+        print(f"{select_func.__name__}: {selected}")
+    if selected is None:
+        return []
+
+    valid, broken = validate_categories(selected, distinct_list)
+    if broken:
+        print(f"{select_func.__name__}: repair {broken}")
+        repaired, _ = validate_categories(repair_categories(session, request, broken, distinct_list), distinct_list)
+        valid += [c for c in repaired if c not in valid]
+    return valid
+
+# The two category selections are independent, so they run concurrently and retry separately
+def select_categories_by_llm(session: Session, request: str, distinct_restaurants: List[str], distinct_spots: List[str],
+                             progress_bar, total_steps: int) -> Tuple[List[str], List[str]]:
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        future_restaurants = executor.submit(tracing.bind(select_categories), get_restaurants_list, session, request, distinct_restaurants)
+        future_tour_spots = executor.submit(tracing.bind(select_categories), get_tour_spots, session, request, distinct_spots)
+        for i, _ in enumerate(as_completed([future_restaurants, future_tour_spots])):
+            if progress_bar is not None:
+                progress_bar.progress((i + 1.0) / total_steps)
+        restaurant_categories = future_restaurants.result()
+        spot_categories = future_tour_spots.result()
+
+    return restaurant_categories, spot_categories
+
+# Map the food and activity preferences to categories with one embedding call
+def select_categories_by_embedding(session: Session, customer_request: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    food_preferences = customer_request.get("food_preferences") or "local food"
+    activity_preferences = customer_request.get("activity_preferences") or customer_request.get("purpose") or "sightseeing"
+    food_vector, activity_vector = embed_texts(session, [food_preferences, activity_preferences])
+
+    restaurant_categories = get_category_embeddings(session, "tourism.public.cl_restaurants_finalized", "cuisine").nearest(food_vector, RANKED_CATEGORIES)
+    spot_categories = get_category_embeddings(session, "tourism.public.tourism_spots_finalized", "category").nearest(activity_vector, RANKED_CATEGORIES)
+    return restaurant_categories, spot_categories
+
+# Categories listed in the selection prompt. When the whole catalog exceeds the token budget,
+# only the categories nearest to the request are listed
+def budget_categories(session: Session, request: str, table_name: str, col_name: str) -> List[str]:
+    categories = get_categories(session, table_name, col_name)
+    budget = prompt_budget.input_budget("plan.category_selection")
+    if prompt_budget.count_tokens(" , ".join(categories)) <= budget:
+        return categories
+    ranked = get_category_embeddings(session, table_name, col_name).nearest(embed_request(session, request), len(categories))
+    return prompt_budget.fit_items(ranked, budget)
+
+# Rank the preferred restaurant and sightseeing categories
+def select_plan_categories(session: Session, request: str, customer_request: Dict[str, str], selector: str = CATEGORY_SELECTOR,
+                           progress_bar=None, total_steps: int = 4) -> Tuple[List[str], List[str]]:
+    if selector == "embedding":
+        restaurant_categories, spot_categories = select_categories_by_embedding(session, customer_request)
+        if progress_bar is not None:
+            progress_bar.progress(2.0 / total_steps)
+        return restaurant_categories, spot_categories
+    distinct_restaurants = budget_categories(session, request, "tourism.public.cl_restaurants_finalized", "cuisine")
+    distinct_spots = budget_categories(session, request, "tourism.public.tourism_spots_finalized", "category")
+    return select_categories_by_llm(session, request, distinct_restaurants, distinct_spots, progress_bar, total_steps)
+
+# The selectors only rank categories. The time slots are built from the travel dates
+def build_spots(dates: List[datetime.date], restaurant_categories: List[str], spot_categories: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    restaurants_list = fill_slots(build_time_slots(dates, MEAL_TIMES), restaurant_categories)
+    tour_spots = fill_slots(build_time_slots(dates, TOUR_TIMES), spot_categories)
+    return restaurants_list, tour_spots
+
+# Select the venues of every slot. Returns the restaurants, the tourist spots and the alternates of both
+# (None when the engine has no alternates)
+def extract_plan(session: Session, request: str, restaurants_list: Dict[str, str], tour_spots: Dict[str, str], engine: str = SCORING_ENGINE,
+                 progress_bar=None, total_steps: int = 4) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # Embed the request once and reuse it for both tables
+    request_vector = embed_request(session, request)
+    restaurants_result_df, restaurant_alternates_df = extract_record(session, "tourism.public.cl_restaurants_finalized", "CUISINE", restaurants_list, request, engine, request_vector)
+    if progress_bar is not None:
+        progress_bar.progress(3.0 / total_steps)
+    tour_result_df, tour_alternates_df = extract_record(session, "tourism.public.tourism_spots_finalized", "CATEGORY", tour_spots, request, engine, request_vector)
+    if progress_bar is not None:
+        progress_bar.progress(4.0 / total_steps)
+    alternates = [df for df in [restaurant_alternates_df, tour_alternates_df] if df is not None]
+    alternates_df = pd.concat(alternates, ignore_index=True) if alternates else None
+    return restaurants_result_df, tour_result_df, alternates_df
+
+def get_requested_df(session: Session, request: str, engine: str = SCORING_ENGINE, selector: str = CATEGORY_SELECTOR) -> Tuple[pd.DataFrame, pd.DataFrame]:
     print(request)
-    request = escape_string_for_sql(request)
-    request = get_arctic_request(session, request)
+    # The local stand-in backend serves tables as pandas, so only the in-process engine can run on it
+    if is_local_session(session):
+        engine = "local"
+    customer_request = parse_customer_request(request)
+    # Checked before any LLM call. Raises TravelDateError, shown to the customer by YOURPLAN
+    dates = travel_dates(customer_request.get("travel_start_date"), customer_request.get("travel_end_date"))
+    with tracing.span("plan.understand"):
+        request = get_arctic_request(session, request)
     with st.expander("Your request understood by Arctic."):
         try:
             st.write(request)
         except:
             st.write("sorry, we can't display your request. but we can proceed.")
 
-    distinct_restaurants = get_distinct_list(session, "tourism.public.cl_restaurants_finalized", "cuisine")
-    distinct_spots = get_distinct_list(session, "tourism.public.tourism_spots_finalized", "category")
-
-    request = escape_string_for_sql(request)
     total_steps = 4
     progress_bar = st.progress(0, text="Extracting in progress using llm and your preferences. Please wait.")
-    for _ in range(5):
-        restaurants_list = get_restaurants_list(session, request)
-        progress_bar.progress(1.0 / total_steps)
-        tour_spots = get_tour_spots(session, request)
-        progress_bar.progress(2.0 / total_steps)
-        if restaurants_list is not None and tour_spots is not None \
-            and check_common_elements(restaurants_list.values(), distinct_restaurants) \
-            and check_common_elements(tour_spots.values(), distinct_spots):
-            break
-        print("Run again because we encountered an error in the data.")
-        print(f"restaurants_list: {restaurants_list}")
-        print(f"tour_spots: {tour_spots}")
-
-    restaurants_result_df = extract_record(session, "tourism.public.cl_restaurants_finalized", "CUISINE", restaurants_list, request)
-    progress_bar.progress(3.0 / total_steps)
-    tour_result_df = extract_record(session, "tourism.public.tourism_spots_finalized", "CATEGORY", tour_spots, request)
-    progress_bar.progress(4.0 / total_steps)
+    with tracing.span("plan.category_selection", selector=selector) as s:
+        restaurant_categories, spot_categories = select_plan_categories(session, request, customer_request, selector, progress_bar, total_steps)
+        s.set(rows=len(restaurant_categories) + len(spot_categories))
+    with tracing.span("plan.scoring", engine=engine) as s:
+        restaurants_list, tour_spots = build_spots(dates, restaurant_categories, spot_categories)
+        restaurants_result_df, tour_result_df, alternates_df = extract_plan(session, request, restaurants_list, tour_spots, engine, progress_bar, total_steps)
+        s.set(rows=len(restaurants_result_df) + len(tour_result_df))
 
     print(restaurants_result_df)
     print(tour_result_df)
@@ -177,6 +396,9 @@ def get_requested_df(session: Session, request: str) -> Tuple[pd.DataFrame, pd.D
         st.dataframe(restaurants_result_df)
         st.write("Here is your tourism spot.")
         st.dataframe(tour_result_df)
+        if alternates_df is not None:
+            st.write("Here is your alternatives.")
+            st.dataframe(alternates_df)
 
     restaurants_result_df.to_csv("./log/restaurants_result_df.csv")
     tour_result_df.to_csv("./log/tour_result_df.csv")
@@ -184,6 +406,6 @@ def get_requested_df(session: Session, request: str) -> Tuple[pd.DataFrame, pd.D
     return restaurants_result_df, tour_result_df
 
 if __name__ == "__main__":
-    session = connect_snowflake()
-    request = get_dummy_request()
-    get_requested_df(session, request)
+    with connect_snowflake() as session:
+        request = get_dummy_request()
+        get_requested_df(session, request)
@@ -0,0 +1,171 @@
+# Local stand-in for Snowflake and Cortex
+# Used instead of connect_snowflake when SAKARCTIC_BACKEND=local, so that the plan and chat flows can be
+# load-tested without a warehouse. It serves the finalized tables from local files, returns deterministic
+# embeddings and canned completions, and injects configurable latency and errors.
+#
+# Table files: <SAKARCTIC_LOCAL_DATA>/<table name>.csv or .parquet (e.g. tourism.public.cl_restaurants_finalized.csv)
+# Export them once from Snowflake with: python demo/services/local_backend.py (run from the top of the repository)
+# Canned completions (optional): <SAKARCTIC_LOCAL_DATA>/completions.json as [{"pattern": "regex", "response": "..."}]
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.environ.get("SAKARCTIC_LOCAL_DATA", "./resources/data/local")
+# Mean latency in seconds of each kind of call
+LATENCY = {
+    "complete": float(os.environ.get("SAKARCTIC_LOCAL_COMPLETE_LATENCY", "2.0")),
+    "embed": float(os.environ.get("SAKARCTIC_LOCAL_EMBED_LATENCY", "0.3")),
+    "sql": float(os.environ.get("SAKARCTIC_LOCAL_SQL_LATENCY", "0.2")),
+}
+# Probability that a call raises LocalBackendError
+ERROR_RATE = float(os.environ.get("SAKARCTIC_LOCAL_ERROR_RATE", "0.0"))
+EMBEDDING_DIM = 768
+
+EXPORT_TABLES = ["tourism.public.cl_restaurants_finalized", "tourism.public.tourism_spots_finalized"]
+
+class LocalBackendError(Exception):
+    pass
+
+# Feature-hashing embedding: the same text always gives the same vector, and texts sharing words are similar
+def deterministic_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"\w+", (text or "").lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] % 2 == 0 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector.tolist()
+
+def tag_content(prompt: str, tag: str) -> str:
+    # The instructions may mention the tag before the tagged block, so take the last one
+    match = re.search(rf"<{tag}>((?:(?!<{tag}>).)*?)</{tag}>", prompt, re.DOTALL)
+    return match.group(1) if match else ""
+
+class LocalSession:
+    def __init__(self, data_dir: str = DATA_DIR, latency: Dict[str, float] = None, error_rate: float = ERROR_RATE, seed: int = None):
+        self.data_dir = data_dir
+        self.latency = latency or LATENCY
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.tables = {}
+        self.canned = []
+        canned_path = os.path.join(data_dir, "completions.json")
+        if os.path.exists(canned_path):
+            with open(canned_path, "r", encoding="utf8") as f:
+                self.canned = [(re.compile(c["pattern"], re.DOTALL), c["response"]) for c in json.load(f)]
+
+    # Sleep for the configured latency (+-20%) and fail with the configured error rate
+    def simulate(self, kind: str):
+        with self.random_lock:
+            delay = max(0.0, self.random.gauss(self.latency.get(kind, 0.0), self.latency.get(kind, 0.0) * 0.2))
+            fail = self.random.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            raise LocalBackendError(f"Injected error in local {kind} call")
+
+    def close(self):
+        self.tables = {}
+
+    def table(self, table_name: str) -> pd.DataFrame:
+        table_name = table_name.lower()
+        if table_name not in self.tables:
+            path = os.path.join(self.data_dir, table_name)
+            if os.path.exists(path + ".parquet"):
+                df = pd.read_parquet(path + ".parquet")
+            else:
+                df = pd.read_csv(path + ".csv")
+            df.columns = [c.upper() for c in df.columns]
+            if "EMBEDED_WEB_SUMMARY" not in df.columns:
+                df["EMBEDED_WEB_SUMMARY"] = [deterministic_embedding(s) for s in df["WEB_SUMMARY"].fillna("")]
+            self.tables[table_name] = df
+        return self.tables[table_name]
+
+    def table_pandas(self, table_name: str, columns: List[str] = None) -> pd.DataFrame:
+        self.simulate("sql")
+        df = self.table(table_name)
+        return df[[c for c in columns if c in df.columns]].copy() if columns else df.copy()
+
+    def table_columns(self, table_name: str) -> List[str]:
+        return list(self.table(table_name).columns)
+
+    def table_version(self, table_name: str) -> str:
+        path = os.path.join(self.data_dir, table_name.lower())
+        path = path + ".parquet" if os.path.exists(path + ".parquet") else path + ".csv"
+        return f"{os.path.getmtime(path)}:{len(self.table(table_name))}"
+
+    def distinct_list(self, table_name: str, col_name: str) -> List[str]:
+        self.simulate("sql")
+        return sorted(self.table(table_name)[col_name.upper()].dropna().unique().tolist())
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self.simulate("embed")
+        return [deterministic_embedding(t) for t in texts]
+
+    # Same return value as snowflake.cortex.complete: text for a string prompt, JSON with metadata otherwise
+    def complete(self, model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None) -> str:
+        self.simulate("complete")
+        prompt = messages if isinstance(messages, str) else messages[-1]["content"]
+        text = self.canned_completion(prompt)
+        if isinstance(messages, str) and not options:
+            return text
+        return json.dumps({
+            "choices": [{"messages": text}],
+            "created": int(time.time()),
+            "model": model,
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4},
+        })
+
+    # Plausible answers for the prompts used by the app
+    def canned_completion(self, prompt: str) -> str:
+        for pattern, response in self.canned:
+            if pattern.search(prompt):
+                return response
+        categories = tag_content(prompt, "categories") or tag_content(prompt, "category")
+        if categories:
+            choices = [c.strip() for c in categories.split(",") if c.strip()]
+            # Numbered categories ("1:japanese,2:italian") are answered with their IDs
+            if re.match(r"\d+:", choices[0]):
+                return json.dumps({"ids": [int(c.split(":")[0]) for c in choices[:3]]})
+            return json.dumps({"categories": choices[:3]})
+        if "catchphrase" in prompt:
+            name = re.search(r'"name": "(.*?)"', prompt)
+            name = name.group(1) if name else "this place"
+            return json.dumps({"catchphrase": f"Enjoy {name}!", "description": f"{name} is a great place to visit during your trip."})
+        if '"next_question"' in prompt:
+            answer = re.search(r"お客様は「(.*?)」と回答", prompt, re.DOTALL)
+            following = re.search(r"次に「(.*?)」を知る", prompt)
+            next_question = f"Could you tell me about {following.group(1)}? (e.g., sightseeing, food, relaxing)" if following else ""
+            return json.dumps({"valid": True, "value": answer.group(1) if answer else "", "next_question": next_question}, ensure_ascii=False)
+        if "質問文" in prompt:
+            return "Could you tell me more about your trip? (e.g., sightseeing, food, relaxing)"
+        return "The customer wants to enjoy sightseeing and local food in San Francisco."
+
+def is_local_session(session) -> bool:
+    return isinstance(session, LocalSession)
+
+# Export the finalized tables from Snowflake into DATA_DIR
+def export_tables(session, data_dir: str = DATA_DIR):
+    os.makedirs(data_dir, exist_ok=True)
+    for table_name in EXPORT_TABLES:
+        df = session.table(table_name).to_pandas()
+        df["EMBEDED_WEB_SUMMARY"] = df["EMBEDED_WEB_SUMMARY"].apply(lambda v: v if isinstance(v, str) else json.dumps(list(v)))
+        df.to_csv(os.path.join(data_dir, table_name + ".csv"), index=False)
+        print(f"{table_name}: {len(df)} rows")
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+    import services.cortex_client
+    export_tables(services.cortex_client.connect_snowflake("Snowflake"))
@@ -0,0 +1,36 @@
+# Validation of the LLM category selections
+# Each category is checked on its own, and unknown categories are mapped to the nearest category
+# in the catalog when a close one exists.
+
+import difflib
+from typing import List, Optional, Tuple
+
+# Similarity threshold for difflib when mapping an unknown category
+CATEGORY_MATCH_CUTOFF = 0.6
+
+# Map a category to the catalog. Returns None if no close category exists
+def nearest_category(category: str, catalog: List[str]) -> Optional[str]:
+    if not isinstance(category, str):
+        return None
+    if category in catalog:
+        return category
+    lower_catalog = {c.lower().strip(): c for c in catalog if isinstance(c, str)}
+    key = category.lower().strip()
+    if key in lower_catalog:
+        return lower_catalog[key]
+    matches = difflib.get_close_matches(key, lower_catalog.keys(), n=1, cutoff=CATEGORY_MATCH_CUTOFF)
+    if matches:
+        return lower_catalog[matches[0]]
+    return None
+
+# Split the ranked categories into valid ones (mapped to the catalog) and broken ones
+def validate_categories(categories: List[str], catalog: List[str]) -> Tuple[List[str], List[str]]:
+    valid = []
+    broken = []
+    for category in categories:
+        mapped = nearest_category(category, catalog)
+        if mapped is None:
+            broken.append(category)
+        elif mapped not in valid:
+            valid.append(mapped)
+    return valid, broken
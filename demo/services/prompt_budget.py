@@ -0,0 +1,78 @@
+# Token budgets of the prompts
+# Cortex latency grows with the number of tokens, and long prompts overflow the 4K context window of snowflake-arctic.
+# Every call site has a budget for its variable fields ("input") and a limit of the answer ("max_tokens").
+# The counts are estimates, not the tokenizer of snowflake-arctic: cl100k_base of tiktoken scaled by TOKEN_SCALE, or a
+# character based estimate when tiktoken is not installed. The budgets leave room for the difference, and the exact
+# numbers of each call are taken from the usage metadata of the Cortex response.
+
+import re
+from typing import Dict, List
+
+try:
+    import tiktoken
+    encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    encoding = None
+
+# snowflake-arctic uses a 32K vocabulary (Llama 2 style), which splits text, Japanese above all, into more tokens than
+# cl100k_base does. 1.3 is a rough correction: compare it with the prompt_tokens traced from the Cortex usage
+TOKEN_SCALE = 1.3
+
+# Budgets in tokens per call site (the stage names used by tracing)
+BUDGETS = {
+    "plan.understand": {"input": 1000, "max_tokens": 300},
+    "plan.category_selection": {"input": 2000, "max_tokens": 100},
+    "plan.description": {"input": 500, "max_tokens": 400},
+    "chat.next_question": {"input": 200, "max_tokens": 150},
+    "chat.turn": {"input": 800, "max_tokens": 250},
+}
+
+def count_tokens(text: str) -> int:
+    text = text or ""
+    if encoding is not None:
+        return int(len(encoding.encode(text)) * TOKEN_SCALE) + 1
+    # About 4 characters per token for ASCII, and 1.5 tokens per character for Japanese
+    ascii_chars = len(re.sub(r"[^\x00-\x7f]", "", text))
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) * 1.5) + 1
+
+def input_budget(call_site: str) -> int:
+    return BUDGETS[call_site]["input"]
+
+def max_tokens(call_site: str) -> int:
+    return BUDGETS[call_site]["max_tokens"]
+
+# Options of a COMPLETE call with the answer limit of the call site
+def complete_options(call_site: str, options: Dict = None) -> Dict:
+    return {**(options or {}), "max_tokens": max_tokens(call_site)}
+
+# Cut the text to the budget, at the end of a sentence when possible
+def truncate_text(text: str, budget: int) -> str:
+    text = text or ""
+    if count_tokens(text) <= budget:
+        return text
+    # Binary search of the longest prefix that fits
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    sentence_end = max(cut.rfind(". "), cut.rfind("。"))
+    if sentence_end > low // 2:
+        cut = cut[:sentence_end + 1]
+    return cut.rstrip() + "..."
+
+# The leading items whose joined text fits the budget. Order the items by importance beforehand
+def fit_items(items: List[str], budget: int, separator: str = " , ") -> List[str]:
+    fitted = []
+    used = 0
+    separator_tokens = count_tokens(separator) - 1
+    for item in items:
+        tokens = count_tokens(item) - 1 + (separator_tokens if fitted else 0)
+        if used + tokens > budget:
+            break
+        fitted.append(item)
+        used += tokens
+    return fitted
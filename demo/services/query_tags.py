@@ -0,0 +1,29 @@
+# Cost attribution of warehouse statements
+# Every statement of the app carries a QUERY_TAG with the stage, the Streamlit session id and the plan id.
+# The Snowpark session is shared by all Streamlit sessions and threads, so the tag is passed with each
+# statement (statement_params) instead of ALTER SESSION. The stage and ids come from the active trace.
+#
+#   {"app": "sakarctic", "stage": "plan.scoring", "session_id": "3f2a...", "plan_id": "9c1e...", "trace_id": "9c1e..."}
+
+import json
+from typing import Dict
+
+import services.tracing as tracing
+
+APP_NAME = "sakarctic"
+
+def query_tag(stage: str = None) -> str:
+    trace = tracing.get_trace()
+    tag = {
+        "app": APP_NAME,
+        "stage": stage or tracing.get_stage() or (trace.name if trace else "background"),
+        "session_id": trace.session_id if trace else None,
+        # A plan trace covers the generation of one plan, so its id is the plan id
+        "plan_id": trace.trace_id if trace and trace.name == "plan" else None,
+        "trace_id": trace.trace_id if trace else None,
+    }
+    return json.dumps(tag, separators=(",", ":"))
+
+# Keyword arguments for collect(), to_pandas(), count() and collect_nowait()
+def statement_params(stage: str = None) -> Dict[str, str]:
+    return {"QUERY_TAG": query_tag(stage)}
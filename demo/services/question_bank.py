@@ -0,0 +1,78 @@
+# Precomputed chat questions
+# The first question of the chat is picked at random from phrasings generated offline with the prompt of the chat,
+# so a new visitor does not wait for a live snowflake-arctic call. The later questions are asked by the chat turn
+# call or prefetched while the user is typing (services/question_prefetch.py), and are not banked.
+#
+# Bank file: resources/data/question_bank.json as {"<title>": ["<question>", ...]}
+# Regenerate it with: python demo/services/question_bank.py --variants 3 (run from the top of the repository)
+
+import json
+import os
+import random
+from typing import Callable, Dict, List, Optional
+
+import streamlit as st
+
+BANK_PATH = "./resources/data/question_bank.json"
+VARIANTS = 3
+# Generations per title before giving up on getting distinct phrasings
+MAX_ATTEMPTS = 10
+
+@st.cache_resource
+def load_question_bank(path: str = BANK_PATH) -> Dict[str, List[str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+def has_question(title: str) -> bool:
+    return bool(load_question_bank().get(title))
+
+# A random phrasing of the question of the title, or None when the title is not in the bank
+def pick_question(title: str) -> Optional[str]:
+    questions = load_question_bank().get(title)
+    return random.choice(questions) if questions else None
+
+# Generate distinct phrasings of each title with generate(title) -> question text
+def build_question_bank(titles: List[str], generate: Callable[[str], str], variants: int = VARIANTS) -> Dict[str, List[str]]:
+    bank = {}
+    for title in titles:
+        questions = []
+        for _ in range(MAX_ATTEMPTS):
+            question = generate(title).strip()
+            if question and question not in questions:
+                questions.append(question)
+            if len(questions) >= variants:
+                break
+        bank[title] = questions
+        print(f"{title}: {len(questions)} questions")
+    return bank
+
+if __name__ == "__main__":
+    import argparse
+    import importlib.util
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+    import services.cortex_client
+
+    parser = argparse.ArgumentParser(description="Generate the question bank of the chat")
+    parser.add_argument("--variants", type=int, default=VARIANTS)
+    parser.add_argument("--secrets", default="Snowflake", help="secret set in .streamlit/secrets.toml")
+    parser.add_argument("--output", default=BANK_PATH)
+    args = parser.parse_args()
+
+    # The prompt and the titles of the chat page
+    page_path = os.path.join(os.path.dirname(__file__), "..", "pages", "1_💬SAKATALK.py")
+    spec = importlib.util.spec_from_file_location("sakatalk_page", page_path)
+    page = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(page)
+
+    session = services.cortex_client.connect_snowflake(args.secrets)
+    def generate(title):
+        messages = [{"role": "user", "content": page.question_prompt(title)}]
+        return page.get_response(session, messages, "chat.next_question")
+    # Only the first question. Banking the later ones would bypass the chat turn and the prefetch
+    titles = [title for title, value in page.initial_result_request().items() if value == ""][:1]
+    bank = build_question_bank(titles, generate, args.variants)
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump(bank, f, ensure_ascii=False, indent=2)
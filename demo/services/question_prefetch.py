@@ -0,0 +1,68 @@
+# Prefetch of the next chat questions
+# The upcoming questions are generated in the background while the user is typing, per browser session.
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import streamlit as st
+
+import services.tracing as tracing
+
+# Number of questions generated ahead of the current one
+PREFETCH_DEPTH = 2
+# Seconds to wait for a question that is still being generated
+TAKE_TIMEOUT = 30
+MAX_WORKERS = 4
+
+@st.cache_resource
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="question_prefetch")
+
+def failed(future: Future) -> bool:
+    return future.done() and not future.cancelled() and future.exception() is not None
+
+class QuestionPrefetcher:
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        # Question title -> generation
+        self.futures: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    # Start generating the questions of titles, in that order, unless they are already buffered.
+    # The buffered questions that are no longer upcoming are cancelled
+    def prefetch(self, titles: List[str], generate: Callable[[str], str]):
+        titles = list(titles)[:PREFETCH_DEPTH]
+        with self.lock:
+            self.cancel_locked(keep=titles)
+            for title in titles:
+                # A generation that failed or was skipped (no free session) is tried again
+                if title not in self.futures or failed(self.futures[title]):
+                    self.futures[title] = self.executor.submit(tracing.bind(generate), title)
+
+    def has(self, title: str) -> bool:
+        with self.lock:
+            return title in self.futures and not failed(self.futures[title])
+
+    # The prefetched question of title, waiting for it if it is still being generated
+    def take(self, title: str, timeout: float = TAKE_TIMEOUT) -> Optional[str]:
+        with self.lock:
+            future = self.futures.pop(title, None)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Prefetch of the question failed: {e}")
+            return None
+
+    def cancel_locked(self, keep: List[str]):
+        for title in list(self.futures):
+            if title not in keep:
+                # A running generation cannot be interrupted, its result is just not used
+                self.futures.pop(title).cancel()
+
+def get_prefetcher() -> QuestionPrefetcher:
+    if "question_prefetcher" not in st.session_state:
+        st.session_state.question_prefetcher = QuestionPrefetcher(get_prefetch_executor())
+    return st.session_state.question_prefetcher
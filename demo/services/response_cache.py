@@ -0,0 +1,99 @@
+# Persistent response cache for Cortex COMPLETE
+# Responses are keyed by (model, messages, options) and stored in a local SQLite file.
+# Entries expire after a TTL, the oldest entries are evicted when the file grows too large,
+# and calls with a non-zero temperature bypass the cache unless the caller allows it.
+# Callers that parse the answer pass a validator, so that malformed answers are neither stored nor replayed.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+import streamlit as st
+
+# Set to False to always call Cortex (e.g. for benchmarks)
+CACHE_ENABLED = True
+CACHE_PATH = "./log/cortex_response_cache.sqlite"
+TTL_SECONDS = 7 * 24 * 3600
+# Upper bound of the total size of the cached responses
+MAX_BYTES = 64 * 1024 * 1024
+
+def response_key(model: str, messages: Union[str, List[Dict[str, str]]], options: Dict = None) -> str:
+    payload = json.dumps({"model": model, "messages": messages, "options": options or {}}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH, ttl: float = TTL_SECONDS, max_bytes: int = MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("create table if not exists responses (key text primary key, response text, size integer, created_at real, accessed_at real)")
+        self.db.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("select response, created_at from responses where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.db.execute("delete from responses where key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("update responses set accessed_at = ? where key = ?", (now, key))
+            self.db.commit()
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            self.db.execute("insert or replace into responses values (?, ?, ?, ?, ?)", (key, response, len(response.encode("utf-8")), now, now))
+            self.evict()
+            self.db.commit()
+
+    def delete(self, key: str):
+        with self.lock:
+            self.db.execute("delete from responses where key = ?", (key,))
+            self.db.commit()
+
+    # Delete expired entries, then the least recently used ones until the size fits. Call with the lock held
+    def evict(self):
+        self.db.execute("delete from responses where created_at < ?", (time.time() - self.ttl,))
+        total = self.db.execute("select coalesce(sum(size), 0) from responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("select key, size from responses order by accessed_at").fetchall():
+            self.db.execute("delete from responses where key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+# One cache per process, shared by all sessions
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    return ResponseCache()
+
+# Return the cached response of a COMPLETE call, or run complete_func and cache its result.
+# With a non-zero temperature the answer is expected to vary, so the cache is bypassed
+# unless cache_nonzero_temperature is set.
+# validate(response) -> bool: only valid responses are cached, and a cached response that is not valid is deleted
+def cached_complete(model: str, messages: Union[str, List[Dict[str, str]]], options: Dict, complete_func: Callable[[], str],
+                    cache_nonzero_temperature: bool = False, validate: Callable[[str], bool] = None) -> str:
+    options = options or {}
+    if not CACHE_ENABLED or (options.get("temperature", 0) != 0 and not cache_nonzero_temperature):
+        return complete_func()
+
+    cache = get_response_cache()
+    key = response_key(model, messages, options)
+    response = cache.get(key)
+    if response is not None:
+        if validate is None or validate(response):
+            return response
+        cache.delete(key)
+    response = complete_func()
+    if response is not None and (validate is None or validate(response)):
+        cache.put(key, response)
+    return response
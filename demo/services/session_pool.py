@@ -0,0 +1,173 @@
+# Snowpark session pool
+# A single cached session makes every user of the server share one connection, so long Cortex calls of one user
+# queue behind the others. The pool keeps up to POOL_SIZE sessions per secret set. A session is checked out for
+# a piece of work and returned afterwards, checked with "select 1" when it has been idle, and replaced before
+# it gets too old for its credentials.
+#
+#   with get_session_pool("Snowflake").session() as session:
+#       ...
+
+import contextlib
+import os
+import threading
+import time
+
+import streamlit as st
+import snowflake.connector
+import snowflake.snowpark as snowpark
+from snowflake.snowpark import Session
+
+from services.local_backend import LocalSession, is_local_session
+
+# "snowflake" or "local" (the offline stand-in in services/local_backend.py)
+BACKEND = os.environ.get("SAKARCTIC_BACKEND", "snowflake")
+
+# Maximum number of sessions per secret set
+POOL_SIZE = int(os.environ.get("SAKARCTIC_POOL_SIZE", "4"))
+# Seconds to wait for a free session
+CHECKOUT_TIMEOUT = 60
+# Sessions are replaced after this many seconds, well before the 2 hours the app used to cache them
+MAX_SESSION_AGE = 3600
+# Sessions idle for longer than this are checked before they are handed out
+HEALTH_CHECK_INTERVAL = 60
+
+# Pool of each pooled session, so that the Cortex client can find more sessions of the same pool
+session_pools = {}
+
+# No session of the pool is free, for work that does not wait for one
+class PoolBusyError(Exception):
+    pass
+
+# Connect to Snowflake with a secret set in .streamlit/secrets.toml
+def create_session(secrets_name: str = "Snowflake") -> Session:
+    if BACKEND == "local":
+        return LocalSession()
+    secrets = st.secrets[secrets_name]
+    connection = snowflake.connector.connect(
+        user=secrets["user"],
+        password=secrets["password"],
+        account=secrets["account"],
+        role=secrets["role"],
+        warehouse=secrets["warehouse"])
+
+    # Create a Snowpark session
+    return snowpark.Session.builder.configs({"connection": connection}).create()
+
+class SessionPool:
+    def __init__(self, secrets_name: str, size: int = POOL_SIZE, max_age: float = MAX_SESSION_AGE):
+        self.secrets_name = secrets_name
+        self.size = size
+        self.max_age = max_age
+        self.idle = []
+        self.opened = 0
+        # Session id -> [created_at, returned_at]
+        self.times = {}
+        self.condition = threading.Condition()
+
+    # Take a session, opening a new one while the pool is not full.
+    # Without blocking, None is returned when every session is in use
+    def checkout(self, timeout: float = CHECKOUT_TIMEOUT, blocking: bool = True) -> Session:
+        deadline = time.time() + timeout
+        with self.condition:
+            while not self.idle and self.opened >= self.size:
+                remaining = deadline - time.time()
+                if not blocking:
+                    return None
+                if remaining <= 0:
+                    raise TimeoutError(f"No Snowflake session was returned to the pool within {timeout} seconds")
+                self.condition.wait(remaining)
+            if self.idle:
+                session = self.idle.pop()
+            else:
+                session = None
+                self.opened += 1
+        if session is None:
+            return self.open()
+        return self.ensure_healthy(session)
+
+    def checkin(self, session: Session):
+        with self.condition:
+            if id(session) in self.times:
+                self.times[id(session)][1] = time.time()
+                self.idle.append(session)
+            self.condition.notify()
+
+    # Without blocking, PoolBusyError is raised when every session is in use
+    @contextlib.contextmanager
+    def session(self, timeout: float = CHECKOUT_TIMEOUT, blocking: bool = True):
+        session = self.checkout(timeout, blocking)
+        if session is None:
+            raise PoolBusyError(f"Every session of {self.secrets_name} is in use")
+        try:
+            yield session
+        finally:
+            self.checkin(session)
+
+    def open(self) -> Session:
+        try:
+            session = create_session(self.secrets_name)
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.times[id(session)] = [time.time(), time.time()]
+        session_pools[id(session)] = self
+        return session
+
+    def close(self, session: Session):
+        with self.condition:
+            self.times.pop(id(session), None)
+            self.opened -= 1
+        session_pools.pop(id(session), None)
+        try:
+            session.close()
+        except Exception as e:
+            print(f"Error: {e}")
+
+    # Replace the session if it is too old or does not answer
+    def ensure_healthy(self, session: Session) -> Session:
+        created_at, returned_at = self.times[id(session)]
+        now = time.time()
+        if now - created_at > self.max_age:
+            self.close(session)
+            return self.reopen()
+        if now - returned_at > HEALTH_CHECK_INTERVAL and not is_local_session(session):
+            try:
+                session.sql("select 1").collect()
+            except Exception as e:
+                print(f"Reconnect a broken Snowflake session: {e}")
+                self.close(session)
+                return self.reopen()
+        return session
+
+    def reopen(self) -> Session:
+        with self.condition:
+            self.opened += 1
+        return self.open()
+
+# One pool per secret set, shared by all sessions of the process
+@st.cache_resource
+def get_session_pool(secrets_name: str = "Snowflake") -> SessionPool:
+    return SessionPool(secrets_name)
+
+# Run on another idle session of the pool of the given session, or on the given session itself
+# when it is not pooled or the pool has no free session. Never waits, so nested use cannot deadlock
+@contextlib.contextmanager
+def borrow(session: Session):
+    pool = session_pools.get(id(session))
+    pooled = pool.checkout(blocking=False) if pool is not None else None
+    try:
+        yield pooled if pooled is not None else session
+    finally:
+        if pooled is not None:
+            pool.checkin(pooled)
+
+# Session source of work that outlives the checkout of the caller, e.g. a background thread: a new checkout from
+# the pool of the session, or the session itself when it is not pooled (the long-lived session of a script)
+def session_source(session: Session):
+    pool = session_pools.get(id(session))
+    if pool is not None:
+        return pool.session
+    return lambda: contextlib.nullcontext(session)
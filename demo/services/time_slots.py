@@ -0,0 +1,65 @@
+# Time slots of an itinerary
+# The slot grid "YYYY/MM/DD hh:mm" is built from the travel dates instead of being written by the LLM.
+
+import datetime
+import re
+from typing import Dict, List, Optional
+
+# Meals are at 8:00, 12:00 and 18:00. Sightseeing avoids the meal times
+MEAL_TIMES = ["08:00", "12:00", "18:00"]
+TOUR_TIMES = ["10:00", "14:00", "16:00"]
+
+# Upper bound of the trip length to keep the plan size reasonable
+MAX_DAYS = 14
+
+class TravelDateError(ValueError):
+    pass
+
+# Read a travel date such as "2024/06/2", "6/2", "2024-06-02" or "06/02/2024".
+# A date without a year is the first one on or after the given date (today by default)
+def parse_travel_date(text: str, after: datetime.date = None) -> Optional[datetime.date]:
+    if not text:
+        return None
+    numbers = [int(v) for v in re.findall(r"\d+", str(text))]
+    if len(numbers) >= 3 and (numbers[0] > 31 or numbers[2] > 31):
+        year, month, day = numbers[:3] if numbers[0] > 31 else (numbers[2], numbers[0], numbers[1])
+        try:
+            return datetime.date(year, month, day)
+        except ValueError:
+            return None
+    if len(numbers) < 2:
+        return None
+    after = after or datetime.date.today()
+    # Up to 4 years ahead, so that 02/29 finds a leap year
+    for year in range(after.year, after.year + 5):
+        try:
+            date = datetime.date(year, numbers[0], numbers[1])
+        except ValueError:
+            continue
+        if date >= after:
+            return date
+    return None
+
+# Dates from start to end (inclusive). Raises TravelDateError when a date cannot be read
+def travel_dates(start_text: str, end_text: str) -> List[datetime.date]:
+    start_date = parse_travel_date(start_text)
+    if start_date is None:
+        raise TravelDateError(f"The travel start date could not be read: {start_text!r}")
+    end_date = parse_travel_date(end_text, after=start_date)
+    if end_date is None:
+        raise TravelDateError(f"The travel end date could not be read: {end_text!r}")
+    if end_date < start_date:
+        raise TravelDateError(f"The travel end date {end_text!r} is before the start date {start_text!r}")
+    days = min((end_date - start_date).days + 1, MAX_DAYS)
+    return [start_date + datetime.timedelta(days=i) for i in range(days)]
+
+# Slot keys "YYYY/MM/DD hh:mm" for every date and time. With the year, the keys sort in time order across the
+# new year, and 02/29 can be read back
+def build_time_slots(dates: List[datetime.date], times: List[str]) -> List[str]:
+    return [f"{d.year:04d}/{d.month:02d}/{d.day:02d} {t}" for d in dates for t in times]
+
+# Assign the ranked categories to the slots in turn
+def fill_slots(slots: List[str], categories: List[str]) -> Dict[str, str]:
+    if not categories:
+        return {}
+    return {slot: categories[i % len(categories)] for i, slot in enumerate(slots)}
@@ -0,0 +1,149 @@
+# Lightweight tracing of the plan pipeline
+# Spans of stages, LLM calls and SQL queries are appended to TRACE_PATH and kept in memory for the sidebar panel.
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict
+
+import pandas as pd
+import streamlit as st
+
+TRACE_ENABLED = True
+TRACE_PATH = "./log/trace.jsonl"
+# Spans whose name starts with one of these are stages. Nested spans inherit the stage of their parent
+STAGE_PREFIXES = ("plan.", "chat.")
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+write_lock = threading.Lock()
+
+class Span:
+    def __init__(self, name: str, trace_id: str, session_id: str, parent_id: str, stage: str, attributes: Dict):
+        self.name = name
+        self.stage = stage
+        self.trace_id = trace_id
+        self.session_id = session_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        return {"trace_id": self.trace_id, "session_id": self.session_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "name": self.name, "stage": self.stage, "start": self.start, "duration": self.duration, "error": self.error, **self.attributes}
+
+class Trace:
+    def __init__(self, name: str, session_id: str = None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.session_id = session_id
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        with self.lock:
+            return pd.DataFrame([s.to_dict() for s in self.spans])
+
+# Identifier of the Streamlit session, kept for the lifetime of the browser tab
+def get_session_id() -> str:
+    if "trace_session_id" not in st.session_state:
+        st.session_state.trace_session_id = uuid.uuid4().hex[:12]
+    return st.session_state.trace_session_id
+
+def start_trace(name: str) -> Trace:
+    return Trace(name, get_session_id())
+
+def get_trace() -> Trace:
+    return current_trace.get()
+
+def get_stage() -> str:
+    s = current_span.get()
+    return s.stage if s is not None else None
+
+@contextlib.contextmanager
+def activate(trace: Trace):
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    trace = current_trace.get()
+    parent = current_span.get()
+    stage = name if name.startswith(STAGE_PREFIXES) else (parent.stage if parent else None)
+    s = Span(name, trace.trace_id if trace else None, trace.session_id if trace else None, parent.span_id if parent else None, stage, attributes)
+    token = current_span.set(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    except Exception as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        # Streamlit reruns and stops are BaseExceptions, so they end the span without an error
+        s.duration = time.perf_counter() - start
+        current_span.reset(token)
+        if trace is not None:
+            trace.add(s)
+        write_span(s)
+
+# Add attributes to the innermost open span, if any
+def annotate(**attributes):
+    s = current_span.get()
+    if s is not None:
+        s.set(**attributes)
+
+# Run func in a copy of the current context, so that spans opened in a worker thread join the trace
+def bind(func: Callable) -> Callable:
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+def write_span(s: Span):
+    if not TRACE_ENABLED:
+        return
+    try:
+        with write_lock:
+            os.makedirs(os.path.dirname(TRACE_PATH) or ".", exist_ok=True)
+            with open(TRACE_PATH, "a", encoding="utf8") as f:
+                f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        print(f"Error: {e}")
+
+# Size of a prompt given as text or as chat messages
+def prompt_size(messages) -> int:
+    if isinstance(messages, str):
+        return len(messages)
+    return sum(len(m.get("content", "")) for m in messages)
+
+# Sidebar panel with the time spent in each stage of the trace and the list of its spans
+def show_trace_panel(trace: Trace, stage_prefix: str = "plan."):
+    df = trace.to_dataframe() if trace is not None else pd.DataFrame()
+    with st.sidebar:
+        st.subheader("Trace")
+        if df.empty:
+            st.caption("No spans yet.")
+            return
+        st.caption(f"trace {trace.trace_id[:8]} / session {trace.session_id}")
+        if "prompt_tokens" in df.columns:
+            st.caption(f"tokens: {int(df['prompt_tokens'].sum())} in / {int(df['completion_tokens'].sum())} out")
+        stages = df[df["name"].str.startswith(stage_prefix)].groupby("name", sort=False)["duration"].sum()
+        if not stages.empty:
+            st.bar_chart(stages)
+        columns = [c for c in ["name", "duration", "rows", "prompt_chars", "response_chars", "prompt_tokens", "completion_tokens", "retries", "cache_hit", "error"] if c in df.columns]
+        st.dataframe(df.sort_values("start")[columns], hide_index=True, use_container_width=True)
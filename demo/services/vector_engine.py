@@ -0,0 +1,137 @@
+# In-process vector scoring engine
+# Load EMBEDED_WEB_SUMMARY of the finalized tables once, and score venues with NumPy instead of the warehouse
+
+import functools
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark import Session
+from snowflake.snowpark.functions import call_udf, col, lit
+
+import services.tracing as tracing
+from services.assignment import ALTERNATES_PER_SLOT, assign_slots
+from services.embedding_cache import embedding_key, get_embedding_cache
+from services.local_backend import is_local_session
+from services.query_tags import statement_params
+
+EMBEDDING_MODEL = "snowflake-arctic-embed-m"
+
+# Same normalization as the crime weight in inquiry_plan.extract_record
+CRIME_MIN = 1291
+CRIME_MAX = 68930
+CRIME_WEIGHT = 0.05
+
+# Output schema of the plan results. Vectors are never shipped back to the app
+def result_columns(category_col_name: str) -> List[str]:
+    return ["NAME", category_col_name.upper(), "WEBSITE", "LATITUDE", "LONGITUDE", "WEB_SUMMARY", "VISIT_TIME"]
+
+# Convert a VECTOR value returned by to_pandas() into a list of floats
+def parse_vector(value) -> List[float]:
+    if isinstance(value, str):
+        return json.loads(value)
+    return list(value)
+
+class VectorIndex:
+    def __init__(self, meta: pd.DataFrame, matrix: np.ndarray, category_col_name: str):
+        self.meta = meta.reset_index(drop=True)
+        self.category_col_name = category_col_name
+        # Rows are L2-normalized so that a dot product equals the cosine similarity
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = (matrix / norms).astype(np.float32)
+        # Static score bonus for safer areas
+        if "SUM_CRIME" in self.meta.columns:
+            crime = self.meta["SUM_CRIME"].fillna(CRIME_MAX).to_numpy(dtype=np.float32)
+            self.bonus = (1 - (crime - CRIME_MIN) / (CRIME_MAX - CRIME_MIN)) * CRIME_WEIGHT
+        else:
+            self.bonus = np.zeros(len(self.meta), dtype=np.float32)
+        self.codes, self.categories = pd.factorize(self.meta[category_col_name])
+        self.names = self.meta["NAME"].to_numpy()
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    # Score all venues with one matrix-vector product
+    def score(self, request_vector: List[float]) -> np.ndarray:
+        query = np.asarray(request_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        return self.matrix @ query + self.bonus
+
+    # Sort venues by (category, score desc). Returns the order and the start offset of each category
+    def rank_by_category(self, scores: np.ndarray):
+        order = np.lexsort((-scores, self.codes))
+        sorted_codes = self.codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        group_starts = dict(zip(sorted_codes[starts].tolist(), starts.tolist()))
+        return order, group_starts
+
+    # Assign a unique venue to every time slot from the top candidates of each requested category
+    # Returns the plan and the ranked alternates of every slot
+    def select(self, spots: Dict[str, str], request_vector: List[float], solver: str = "greedy") -> Tuple[pd.DataFrame, pd.DataFrame]:
+        scores = self.score(request_vector)
+        order, group_starts = self.rank_by_category(scores)
+        category_codes = {category: code for code, category in enumerate(self.categories)}
+        group_ends = dict(zip(group_starts.keys(), list(group_starts.values())[1:] + [len(order)]))
+
+        top_k = len(spots) + ALTERNATES_PER_SLOT
+        rows = []
+        for category in set(spots.values()):
+            code = category_codes.get(category)
+            if code is not None:
+                rows.extend(order[group_starts[code]:min(group_starts[code] + top_k, group_ends[code])].tolist())
+
+        candidates = self.meta.iloc[rows].copy()
+        candidates["SCORE"] = scores[rows]
+        return assign_slots(spots, candidates, self.category_col_name, result_columns(self.category_col_name), solver)
+
+# Load the embeddings of a finalized table once per process
+@st.cache_resource(ttl=7200)
+def load_vector_index(_session: Session, table_name: str, category_col_name: str) -> VectorIndex:
+    columns = [c for c in result_columns(category_col_name) if c != "VISIT_TIME"] + ["EMBEDED_WEB_SUMMARY"]
+    with tracing.span("sql.to_pandas", table=table_name) as s:
+        if is_local_session(_session):
+            if "SUM_CRIME" in _session.table_columns(table_name):
+                columns.append("SUM_CRIME")
+            df = _session.table_pandas(table_name, columns)
+        else:
+            df = _session.table(table_name)
+            if "SUM_CRIME" in df.columns:
+                columns.append("SUM_CRIME")
+            df = df.select(columns).to_pandas(statement_params=statement_params())
+        s.set(rows=len(df))
+    vectors = df.pop("EMBEDED_WEB_SUMMARY")
+    df = df[vectors.notna()]
+    matrix = np.array([parse_vector(v) for v in vectors.dropna()], dtype=np.float32)
+    return VectorIndex(df, matrix, category_col_name)
+
+# Embed the request text with one Cortex call, or return it from the embedding cache
+def embed_request(session: Session, request_description: str) -> List[float]:
+    return embed_texts(session, [request_description])[0]
+
+# Embed several texts. Cached texts are reused and the rest are embedded with one query.
+# The order of the result follows the input
+def embed_texts(session: Session, texts: List[str]) -> List[List[float]]:
+    cache = get_embedding_cache()
+    keys = [embedding_key(t, EMBEDDING_MODEL) for t in texts]
+    vectors = [cache.get(key) for key in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    with tracing.span("llm.embed", texts=len(texts), cache_hits=len(texts) - len(missing), prompt_chars=sum(len(t) for t in texts)):
+        if missing:
+            embed_func = session.embed if is_local_session(session) else functools.partial(query_embeddings, session)
+            for i, vector in zip(missing, embed_func([texts[i] for i in missing])):
+                vectors[i] = vector
+                cache.put(keys[i], vector)
+    return vectors
+
+# Embed texts on the warehouse with one query
+def query_embeddings(session: Session, texts: List[str]) -> List[List[float]]:
+    df = session.create_dataframe([[i, t] for i, t in enumerate(texts)], schema=["idx", "text"])
+    rows = df.select(col("idx"), call_udf("snowflake.cortex.EMBED_TEXT_768",
+                                          lit(EMBEDDING_MODEL),
+                                          col("text")).alias("V")).sort(col("idx")).collect(statement_params=statement_params())
+    return [parse_vector(row["V"]) for row in rows]
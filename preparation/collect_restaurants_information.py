@@ -66,6 +66,8 @@ def get_summarized_web_df(session: Session, df: pd.DataFrame, col_name: str="WEB
     return df
 
 def write_summarized_table_website(session: Session, input_table: str, col_name: str, output_table: str) -> None:
+    # コスト集計用のクエリタグ (demo/services/query_tags.pyと同じ形式)。このスクリプトはセッションを専有するのでセッションに設定する
+    session.query_tag = json.dumps({"app": "sakarctic", "stage": "prep.summarize_website", "table": input_table}, separators=(",", ":"))
     df = session.table(input_table).to_pandas()
     df = get_summarized_web_df(session, df, col_name=col_name)
     session.write_pandas(df, output_table, auto_create_table=True, overwrite=True)
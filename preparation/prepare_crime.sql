@@ -1,5 +1,7 @@
 use role sysadmin;
 use database tourism;
+// cost attribution (see demo/services/query_tags.py)
+alter session set query_tag = '{"app":"sakarctic","stage":"prep.prepare_crime"}';
 
 CREATE OR REPLACE TABLE POPULATIONS_STATISTICS AS
 SELECT
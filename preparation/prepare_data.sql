@@ -1,5 +1,7 @@
 use role sysadmin;
 use database tourism;
+// cost attribution (see demo/services/query_tags.py)
+alter session set query_tag = '{"app":"sakarctic","stage":"prep.prepare_data"}';
 
 // data cleansing
 CREATE OR REPLACE TABLE cl_restaurants_finalized AS
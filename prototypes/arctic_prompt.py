@@ -10,8 +10,6 @@
 import streamlit as st
 
 # Snowflake and Snowpark
-import snowflake.connector
-import snowflake.snowpark as snowpark
 import snowflake.cortex as cortex
 
 # OpenAI Tokenizer library
@@ -19,6 +17,12 @@ import tiktoken
 
 # General libraries
 import json
+import os
+import sys
+
+# demo/servicesのCortexクライアントを使う
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "demo"))
+import services.cortex_client
 
 # Initialize Streamlit
 def init():
@@ -26,20 +30,9 @@ def init():
     st.title("Snowflake Arctic Prompt")
 
 # ローカルPython環境からSnowflakeに接続するための関数
-@st.cache_resource(ttl=7200)
 def connect_snowflake():
-    # Snowflakeに接続する
     # Snowflakeの接続情報はStreamlitのシークレット(.streamlit/secret.toml)に保存しておく
-    connection = snowflake.connector.connect(
-        user=st.secrets["Snowflake"]["user"],
-        password=st.secrets["Snowflake"]["password"],
-        account=st.secrets["Snowflake"]["account"],
-        role=st.secrets["Snowflake"]["role"],
-        warehouse=st.secrets["Snowflake"]["warehouse"])
-
-    # Snowparkセッションを作成する
-    session = snowpark.Session.builder.configs({"connection": connection}).create()
-    return session 
+    return services.cortex_client.connect_snowflake("Snowflake")
 
 # ログを表示する
 @st.experimental_fragment
@@ -63,17 +56,12 @@ def estimate_token_count(prompt):
     tokens1 = encoding1.encode(prompt)
     return len(tokens1)
 
-# SQLでSnowflake Cortex LLM Functionsを呼び出す
+# Snowflake Cortex LLM Functionsを呼び出す
 def cortex_complete(session, model_name, prompt, temperature):
-    # 注意！本来はSQLインジェクション攻撃ができないように適切に文字列を処理することが望ましい
-    # プロンプトをエスケープする
-    prompt = prompt.replace('\'', '\\\'')
+    # プロンプトはバインド変数で渡すのでエスケープは不要
     # JSONで入力すると出力のときにメタデータが得られる
-    cmd = f"select snowflake.cortex.complete('{model_name}', [{{'role': 'user', 'content': '{prompt}'}}], {{'temperature': {temperature}}}) as RESPONSE"
-    # session.sqlの出力はROWのリストとして得られる
-    # ROWの"RESPONSE"キーにJSON文字列が格納されている。キーは必ずアッパーケースになることに注意
-    df_response = session.sql(cmd).collect()
-    json_response = json.loads(df_response[0]["RESPONSE"])
+    response = services.cortex_client.get_cortex_client(session).complete(model_name, [{"role": "user", "content": prompt}], {"temperature": temperature})
+    json_response = json.loads(response)
     return json_response
 
 # Snowflake Cortex LLM FunctionsのJSONからレスポンスだけを抽出する
@@ -0,0 +1,106 @@
+# Tests of the rule-based chat answer parsers. Ambiguous answers must return None, so that the chat asks the LLM
+# Run from the top of the repository: python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "demo"))
+from services.answer_parsers import parse_age, parse_answer, parse_budget, parse_date, parse_people
+
+@pytest.mark.parametrize("answer, expected", [
+    ("2", "2 people"),
+    ("two", "2 people"),
+    ("2 adults", "2 people"),
+    ("a couple", "2 people"),
+    ("3 of us", "3 people"),
+    ("２人", "2 people"),
+    ("二人", "2 people"),
+    ("alone", "1 person"),
+    ("just me", "1 person"),
+])
+def test_parse_people(answer, expected):
+    assert parse_people(answer) == expected
+
+@pytest.mark.parametrize("answer", [
+    "2 adults and 2 kids",
+    "2 adults and 1 child",
+    "me and a couple of friends",
+    "me and my wife",
+    "just me and my son",
+    "2 or 3",
+    "2 days",
+    "1.5",
+    "100",
+    "",
+])
+def test_parse_people_ambiguous(answer):
+    assert parse_people(answer) is None
+
+@pytest.mark.parametrize("answer, expected", [
+    ("30", "30"),
+    ("30 and 28", "30, 28"),
+    ("30, 28", "30, 28"),
+    ("30s", "30s"),
+    ("I'm 35 years old", "35"),
+    ("30代", "30s"),
+    ("35歳", "35"),
+    ("30代と28歳", "30s, 28"),
+])
+def test_parse_age(answer, expected):
+    assert parse_age(answer) == expected
+
+@pytest.mark.parametrize("answer", [
+    "on 5/3",
+    "100 dollars",
+    "35 with a 5-year-old",
+    "30-35",
+    "30.5",
+    "200",
+    "young",
+])
+def test_parse_age_ambiguous(answer):
+    assert parse_age(answer) is None
+
+@pytest.mark.parametrize("answer, expected", [
+    ("05/03", "05/03"),
+    ("5/3", "05/03"),
+    ("2024-05-03", "05/03"),
+    ("May 3rd", "05/03"),
+    ("3 May", "05/03"),
+    ("5月3日", "05/03"),
+    ("02/29", "02/29"),
+])
+def test_parse_date(answer, expected):
+    assert parse_date(answer) == expected
+
+@pytest.mark.parametrize("answer", ["tomorrow", "next week", "5/3 to 5/6", "13/40", "soon"])
+def test_parse_date_ambiguous(answer):
+    assert parse_date(answer) is None
+
+@pytest.mark.parametrize("answer, expected", [
+    ("$1,500", "1500 USD"),
+    ("1500 dollars", "1500 USD"),
+    ("100,000 yen", "100000 JPY"),
+    ("10万円", "100000 JPY"),
+    ("2k USD", "2000 USD"),
+])
+def test_parse_budget(answer, expected):
+    assert parse_budget(answer) == expected
+
+@pytest.mark.parametrize("answer", [
+    "1500",
+    "$1000 or 1000 euros",
+    "$1000-2000",
+    "a lot of dollars",
+    "1 million yen",
+    "1.5 million yen",
+    "$100 per person per day",
+    "$3000 each",
+])
+def test_parse_budget_ambiguous(answer):
+    assert parse_budget(answer) is None
+
+def test_parse_answer_unknown_slot():
+    assert parse_answer("purpose", "sightseeing") is None